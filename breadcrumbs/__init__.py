@@ -1,11 +1,14 @@
 """
 A package for todo management.
 """
-from breadcrumbs.top_level import run
 
 def main() -> None:
     """
-    Runs the CLI
+    Runs the CLI. One shot commands are handed to the daemon of the breadbox
+    when one is running, so the full app is only imported when needed.
     """
+    from breadcrumbs.client import forward
+    if (forward()):
+        return
+    from breadcrumbs.top_level import run
     run()
-
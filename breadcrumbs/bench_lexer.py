@@ -0,0 +1,107 @@
+"""
+Benchmark of the todo.txt lexers (TodotxtLexer and FastTodotxtLexer).
+
+Run with `python -m breadcrumbs.bench_lexer [loaf_file]`. Without a loaf file
+one is made up. Both lexers lex every line of the loaf, as easy_lex does when
+showing it, and the one with the lowest time over a few runs is shown. The
+tokens of both are checked to be the same.
+"""
+
+from argparse import ArgumentParser, Namespace
+from pathlib import Path
+from random import Random
+from timeit import repeat
+from typing import List
+
+from pygments.lexer import Lexer
+from rich.console import Console
+from rich.table import Table
+
+from breadcrumbs.lexer import FastTodotxtLexer, TodotxtLexer
+
+# Words the made up loaf is built from
+WORDS = ["bread", "toast", "rye", "call", "mail", "gym", "cook", "read",
+         "+work", "+home", "@phone", "@desk", "cost:2.5", "TIME:10-47"]
+
+def make_loaf(count: int, seed: int = 1103) -> List[str]:
+    """
+    Makes up crumbs, about a fifth of them archived.
+
+    :param count: How many crumbs to make.
+    :param seed: Makes the same crumbs each time.
+    :return: The crumb lines.
+    """
+    r = Random(seed)
+    ret = list()
+    for i in range(count):
+        made = f"2022-{r.randint(1, 12):02}-{r.randint(1, 28):02}"
+        text = " ".join(r.choice(WORDS) for x in range(r.randint(2, 8)))
+        if (r.random() < 0.2):
+            ret.append(f"x {made} {made} {text}")
+        elif (r.random() < 0.1):
+            ret.append(f"(A) {made} {text}")
+        else:
+            ret.append(f"{made} {text}")
+    return ret
+
+def lex_all(lexer: Lexer, lines: List[str]) -> None:
+    """
+    Lexes each line of a loaf on its own.
+
+    :param lexer: The lexer to use.
+    :param lines: The crumb lines.
+    """
+    for x in lines:
+        for tok in lexer.get_tokens(x):
+            pass
+
+def parse_args() -> Namespace:
+    """
+    Parses the cli args.
+
+    :return: The parsed args.
+    """
+    parser = ArgumentParser(prog="bench_lexer",
+                            description="Times the todo.txt lexers.")
+    parser.add_argument("loaf", nargs="?", default=None,
+                        help="Loaf file to lex, one is made up if not given.")
+    parser.add_argument("-c", "--count", type=int, default=20000,
+                        help="How many crumbs to make up.")
+    parser.add_argument("-r", "--runs", type=int, default=5,
+                        help="How many times each lexer is timed.")
+    return parser.parse_args()
+
+def main() -> None:
+    """
+    Times both lexers on a loaf and shows how they compare.
+    """
+    args = parse_args()
+    if (args.loaf is not None):
+        lines = Path(args.loaf).read_text().splitlines()
+    else:
+        lines = make_loaf(args.count)
+    lexers = {
+        "TodotxtLexer": TodotxtLexer(),
+        "FastTodotxtLexer": FastTodotxtLexer(),
+    }
+    base = lexers["TodotxtLexer"]
+    for x in lines:
+        if (list(base.get_tokens(x))
+                != list(lexers["FastTodotxtLexer"].get_tokens(x))):
+            raise Exception(f"The lexers do not agree on '{x}'.")
+    t = Table(title=f"Lexing {len(lines)} crumbs (best of {args.runs}).")
+    t.add_column("Lexer")
+    t.add_column("Time (s)")
+    t.add_column("Crumbs / s")
+    t.add_column("Speedup")
+    times = dict()
+    for name, lexer in lexers.items():
+        times[name] = min(repeat(lambda: lex_all(lexer, lines), number=1,
+                                 repeat=args.runs))
+    for name, took in times.items():
+        t.add_row(name, f"{took:.3f}", f"{(len(lines) / took):.0f}",
+                  f"{(times['TodotxtLexer'] / took):.2f}x")
+    Console().print(t)
+
+if (__name__ == "__main__"):
+    main()
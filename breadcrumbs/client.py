@@ -0,0 +1,162 @@
+"""
+Module of the thin client used to talk to a running `bc --daemon`.
+
+This module must stay cheap to import (standard library only), as it is what
+runs for every one shot `bc "<command>"` when a daemon is up.
+
+Both sides talk in frames: one byte saying what the frame is, four bytes of
+big endian payload length, then the utf-8 payload.
+"""
+
+from argparse import ArgumentParser, Namespace
+from json import dumps
+from os import environ, get_terminal_size
+from pathlib import Path
+from socket import AF_UNIX, SOCK_STREAM, socket
+from subprocess import run
+from sys import stdin, stdout
+from typing import List, Tuple, Union
+
+# Client -> daemon: a request, the payload is json
+REQUEST = b"C"
+# Client -> daemon: a line of user input
+ANSWER = b"I"
+# Client -> daemon: the exit code of an external command
+EXITED = b"X"
+# Daemon -> client: display output
+OUTPUT = b"O"
+# Daemon -> client: read a line of user input
+ASK = b"R"
+# Daemon -> client: run an external command (Eg. the editor)
+EXTERNAL = b"E"
+# Daemon -> client: the request is done
+DONE = b"D"
+# The name of the daemon socket in the breadbox
+SOCKET_NAME = "daemon.sock"
+
+def find_breadbox() -> Path:
+    """
+    Finds the breadbox the same way the root plugin does, without making one.
+
+    :return: The location of the breadbox.
+    """
+    if (Path(".breadbox").is_dir()):
+        return Path(".breadbox")
+    return Path.home() / ".breadbox"
+
+def socket_path(breadbox: Union[str, Path]) -> Path:
+    """
+    Gets where the daemon of a breadbox listens.
+
+    :param breadbox: The location of the breadbox.
+    :return: The path of the socket.
+    """
+    return Path(breadbox) / SOCKET_NAME
+
+def send_frame(conn: socket, kind: bytes, text: str = "") -> None:
+    """
+    Sends a frame.
+
+    :param conn: The connection to send over.
+    :param kind: What the frame is.
+    :param text: The payload of the frame.
+    """
+    data = text.encode("utf-8")
+    conn.sendall(kind + len(data).to_bytes(4, "big") + data)
+
+def recv_exact(conn: socket, size: int) -> bytes:
+    """
+    Reads an exact number of bytes off a connection.
+
+    :param conn: The connection to read from.
+    :param size: How many bytes to read.
+    :return: The bytes.
+    """
+    ret = b""
+    while (len(ret) < size):
+        tmp = conn.recv(size - len(ret))
+        if (not tmp):
+            raise ConnectionError("Connection closed mid frame.")
+        ret += tmp
+    return ret
+
+def recv_frame(conn: socket) -> Tuple[bytes, str]:
+    """
+    Reads a frame.
+
+    :param conn: The connection to read from.
+    :return: What the frame is and its payload.
+    """
+    head = recv_exact(conn, 5)
+    size = int.from_bytes(head[1:], "big")
+    return (head[:1], str(recv_exact(conn, size), "utf-8"))
+
+def parse_client_args(argv: Union[List[str], None] = None) -> Namespace:
+    """
+    Parses the part of the CLI arguments the client cares about. Anything it
+    does not understand is left to the full CLI.
+
+    :param argv: The arguments, None for the real ones.
+    :return: The parsed args.
+    """
+    parser = ArgumentParser(prog='bc', add_help=False)
+    parser.add_argument('-d', "--debug", action="store_true")
+    parser.add_argument('-s', "--simple", action="store_true")
+    parser.add_argument('-j', "--json", action="store_true")
+    parser.add_argument("--json-stream", action="store_true")
+    parser.add_argument("--daemon", action="store_true")
+    parser.add_argument("--batch")
+    parser.add_argument('crumb_command', nargs='?', default="")
+    args, rest = parser.parse_known_args(argv)
+    args.rest = rest
+    return args
+
+def forward(argv: Union[List[str], None] = None) -> bool:
+    """
+    Sends a one shot crumb command to the daemon of the breadbox and streams
+    back what it displays.
+
+    :param argv: The CLI arguments, None for the real ones.
+    :return: False if there is nothing to forward to (no command, or no
+    daemon listening), so the command should be run in process.
+    """
+    args = parse_client_args(argv)
+    if (args.daemon or args.batch or args.rest or (not args.crumb_command)):
+        return False
+    path = socket_path(find_breadbox())
+    if (not path.exists()):
+        return False
+    conn = socket(AF_UNIX, SOCK_STREAM)
+    try:
+        conn.connect(str(path))
+    except OSError as e:
+        conn.close()
+        return False
+    try:
+        width = get_terminal_size().columns
+    except OSError as e:
+        width = 80
+    request = {
+        "command": args.crumb_command,
+        "debug": args.debug,
+        "simple": args.simple,
+        "json": args.json,
+        "json_stream": args.json_stream,
+        "tty": stdout.isatty(),
+        "width": width
+    }
+    with conn:
+        send_frame(conn, REQUEST, dumps(request))
+        while (True):
+            kind, text = recv_frame(conn)
+            if (kind == OUTPUT):
+                stdout.write(text)
+                stdout.flush()
+            elif (kind == ASK):
+                send_frame(conn, ANSWER, stdin.readline())
+            elif (kind == EXTERNAL):
+                ret = run(text, shell=True, env=environ)
+                send_frame(conn, EXITED, str(ret.returncode))
+            elif (kind == DONE):
+                break
+    return True
@@ -4,14 +4,13 @@ Defines the core commands in a plugin.
 from datetime import datetime
 from json import loads
 from re import sub
-from subprocess import run
 from typing import Dict, Any
-from deep_translator.base import Path
+from pathlib import Path
 
 from pytodotxt import Task, TodoTxt
 from tempfile import NamedTemporaryFile, TemporaryFile
 from rich.table import Table
-from breadcrumbs.utils import add_task, archive, drop_buffer, easy_lex, get_contexts, get_projects, get_tags, loaf_search, unarchive, get_buffer, set_buffer
+from breadcrumbs.utils import add_task, archive, drop_buffer, easy_lex, flush, get_contexts, get_projects, get_tags, loaf_search, mark_changed, redo, run_external, save, unarchive, undo, get_buffer, page_bounds, set_buffer, show_crumbs
 
 
 def print_buffer_cmd(conf: Dict[str, Any], loaf: TodoTxt, args: str) -> bool:
@@ -25,14 +24,37 @@ def print_buffer_cmd(conf: Dict[str, Any], loaf: TodoTxt, args: str) -> bool:
     exp_time = datetime.fromtimestamp(buffer_time)
     conf["log"]["clear"]()
     conf["log"]["title"]("SELECTION BUFFER")
-    for x in res:
-        conf["log"]["crumb"](x)
+    show_crumbs(conf, res)
     if (not res):
         conf["log"]["info"]("Buffer is empty...")
     else:
         conf["log"]["info"](f"Buffer auto-expires at {exp_time}.")
     return False
 
+def page_cmd(conf: Dict[str, Any], loaf: TodoTxt, args: str) -> bool:
+    """
+    - <ID> -> Optional. If present the page holding the crumb with that ID
+      (as given by ?vv) is shown, - shows the page before. Otherwise the next
+      page is shown.
+    - Pages through the selection buffer.
+    - Does not save under any condition.
+    """
+    res = get_buffer(conf)
+    page = conf["buffers"]["page"]
+    if (args == "-"):
+        page -= 1
+    elif (args):
+        page = int(args) // max(conf["page_size"], 1)
+    else:
+        # After the last page comes the first again
+        page = ((page + 1) % page_bounds(conf, len(res), page)[1])
+    conf["log"]["clear"]()
+    conf["log"]["title"]("SELECTION BUFFER")
+    show_crumbs(conf, res, page)
+    if (not res):
+        conf["log"]["info"]("Buffer is empty...")
+    return False
+
 def raw_add_cmd(conf: Dict[str, Any], loaf: TodoTxt, args: str) -> bool:
     """
     - <crumb> -> The crumb to add.
@@ -44,8 +66,7 @@ def raw_add_cmd(conf: Dict[str, Any], loaf: TodoTxt, args: str) -> bool:
     res = loaf_search(loaf, span="1d-~", archived=False)
     conf["log"]["clear"]()
     conf["log"]["title"]("BREADCRUMB TRAIL")
-    for x in res:
-        conf["log"]["crumb"](x)
+    conf["log"]["crumbs"](res)
     set_buffer(conf, [tmp])
     return True
 
@@ -58,12 +79,13 @@ def add_cmd(conf: Dict[str, Any], loaf: TodoTxt, args: str) -> bool:
     tmp = add_task(loaf, args)
     if (not tmp.description):
         return False
+    set_buffer(conf, [tmp])
+    if (conf["buffers"]["batch"]):
+        return True
     res = loaf_search(loaf, span="1d-~", archived=False)
     conf["log"]["clear"]()
     conf["log"]["title"]("BREADCRUMB TRAIL")
-    for x in res:
-        conf["log"]["crumb"](x)
-    set_buffer(conf, [tmp])
+    conf["log"]["crumbs"](res)
     return True
 
 def export_json_cmd(conf: Dict[str, Any], loaf: TodoTxt, args: str) -> bool:
@@ -87,8 +109,9 @@ def edit_external_cmd(conf: Dict[str, Any], loaf: TodoTxt, args: str) -> bool:
     else:
         edit = conf['editor']
     tmp = edit.replace("%P", (conf['breadbox'] + "/selection_buffer"))
+    flush()
     try:
-        ret = run(tmp, shell= True, encoding='utf-8', check=True)
+        run_external(tmp)
     except Exception as e:
         conf['log']['err']("Not saving...", e)
         return False
@@ -133,13 +156,11 @@ def block_add_cmd(conf: Dict[str, Any], loaf: TodoTxt, args: str) -> bool:
         conf["log"]["clear"]()
         conf["log"]["title"]("BLOCK EDIT")
         conf["log"]["figure"](t)
-        for x in tmp:
-            conf["log"]["crumb"](x)
+        conf["log"]["crumbs"](tmp)
     conf["log"]["clear"]()
     conf["log"]["title"]("BLOCK EDIT")
     conf["log"]["figure"](t)
-    for x in tmp:
-        conf["log"]["crumb"](x)
+    conf["log"]["crumbs"](tmp)
     conf["log"]["info"]("Saving Block")
     set_buffer(conf, tmp)
     return True
@@ -277,8 +298,7 @@ def archive_cmd(conf: Dict[str, Any], loaf: TodoTxt, args: str) -> bool:
     archive(res)
     conf["log"]["clear"]()
     conf["log"]["title"]("ARCHIVED")
-    for x in res:
-        conf["log"]["crumb"](x)
+    show_crumbs(conf, res)
     conf["log"]["info"](f"Archived {len(res)} crumbs.")
     return True
 
@@ -292,8 +312,7 @@ def unarchive_cmd(conf: Dict[str, Any], loaf: TodoTxt, args: str) -> bool:
     unarchive(res)
     conf["log"]["clear"]()
     conf["log"]["title"]("UNARCHIVED")
-    for x in res:
-        conf["log"]["crumb"](x)
+    show_crumbs(conf, res)
     conf["log"]["info"](f"Unarchived {len(res)} crumbs.")
     return True
 
@@ -308,8 +327,7 @@ def select_cmd(conf: Dict[str, Any], loaf: TodoTxt, args: str) -> bool:
     set_buffer(conf, res)
     conf["log"]["clear"]()
     conf["log"]["title"]("SELECT")
-    for x in res:
-        conf["log"]["crumb"](x)
+    show_crumbs(conf, res)
     return True
 
 def select_archive_cmd(conf: Dict[str, Any], loaf: TodoTxt, args: str) -> bool:
@@ -323,8 +341,7 @@ def select_archive_cmd(conf: Dict[str, Any], loaf: TodoTxt, args: str) -> bool:
     set_buffer(conf, res)
     conf["log"]["clear"]()
     conf["log"]["title"]("STALE SELECT")
-    for x in res:
-        conf["log"]["crumb"](x)
+    show_crumbs(conf, res)
     return True
 
 def sub_select_cmd(conf: Dict[str, Any], loaf: TodoTxt, args: str) -> bool:
@@ -336,11 +353,17 @@ def sub_select_cmd(conf: Dict[str, Any], loaf: TodoTxt, args: str) -> bool:
     res = get_buffer(conf)
     conf["log"]["clear"]()
     conf["log"]["title"]("SUB-SELECT MODE")
-    t = Table(title="Selection Buffer.")
+    # Only the page last shown is drawn, IDs on other pages can still be given
+    page, pages, start, end = page_bounds(conf, len(res),
+                                          conf["buffers"]["page"])
+    if (pages == 1):
+        t = Table(title="Selection Buffer.")
+    else:
+        t = Table(title=f"Selection Buffer (page {page + 1}/{pages}).")
     t.add_column("ID")
     t.add_column("Crumb")
-    for i, x in enumerate(res):
-        t.add_row(str(i), easy_lex(x))
+    for i in range(start, end):
+        t.add_row(str(i), easy_lex(res[i]))
     conf["log"]["figure"](t)
     sel = conf["log"]["prompt"](f"Space Seperated ID Selection")
     sel_list = sel.split()
@@ -363,8 +386,7 @@ def advanced_select_cmd(conf: Dict[str, Any], loaf: TodoTxt, args: str) -> bool:
     set_buffer(conf, res)
     conf["log"]["clear"]()
     conf["log"]["title"]("ADVANCED SELECT")
-    for x in res:
-        conf["log"]["crumb"](x)
+    show_crumbs(conf, res)
     return True
 
 def list_cmd(conf: Dict[str, Any], loaf: TodoTxt, args: str) -> bool:
@@ -376,22 +398,36 @@ def list_cmd(conf: Dict[str, Any], loaf: TodoTxt, args: str) -> bool:
     res = loaf_search(loaf, span="1d-~", archived=False)
     conf["log"]["clear"]()
     conf["log"]["title"]("BREADCRUMB TRAIL")
-    for x in res:
-        conf["log"]["crumb"](x)
+    conf["log"]["crumbs"](res)
     return False
 
 def undo_cmd(conf: Dict[str, Any], loaf: TodoTxt, args: str) -> bool:
     """
     - No args.
-    - Undo the last addition.
-    - Always saves.
+    - Undo the last command that changed the loaf. Can be repeated to go
+      further back.
+    - Saves if there was something to undo.
     """
-    tmp = loaf.tasks[-1]
-    tmp.is_completed = True
+    if (not undo(loaf)):
+        conf["log"]["info"]("Nothing to undo...")
+        return False
     list_cmd(conf, loaf, args)
     conf["log"]["info"]("Undo successful...")
     return True
 
+def redo_cmd(conf: Dict[str, Any], loaf: TodoTxt, args: str) -> bool:
+    """
+    - No args.
+    - Redo the last undone command.
+    - Saves if there was something to redo.
+    """
+    if (not redo(loaf)):
+        conf["log"]["info"]("Nothing to redo...")
+        return False
+    list_cmd(conf, loaf, args)
+    conf["log"]["info"]("Redo successful...")
+    return True
+
 def substitute_cmd(conf: Dict[str, Any], loaf: TodoTxt, args: str) -> bool:
     """
     - <before_regex>/<after_regex>.
@@ -410,10 +446,23 @@ def substitute_cmd(conf: Dict[str, Any], loaf: TodoTxt, args: str) -> bool:
     for x in res:
         tmp = x.description
         x.description = sub(before_regex, after_regex, tmp)
+        x.parse_attributes()
         t.add_row(easy_lex(tmp), easy_lex(x.description))
+    mark_changed(res)
     conf["log"]["figure"](t)
     return True
 
+def compact_cmd(conf: Dict[str, Any], loaf: TodoTxt, args: str) -> bool:
+    """
+    - No args.
+    - Sorts the loaf and rewrites it on disk in full. If loaf_segments is set,
+      archived crumbs older than hot_days are moved to cold segments.
+    - Saves.
+    """
+    save(loaf, compact=True)
+    conf["log"]["info"](f"Compacted {len(loaf.tasks)} crumbs.")
+    return False
+
 def load_plugin() -> Dict[str, Any]:
     """
     This is a function that will do what it need to to load the 'plugin' and
@@ -439,6 +488,7 @@ def load_plugin() -> Dict[str, Any]:
 
     commands = {
         "lv": print_buffer_cmd,
+        "p": page_cmd,
         "e!": raw_add_cmd,
         "e": add_cmd,
         "ex": edit_external_cmd,
@@ -454,11 +504,13 @@ def load_plugin() -> Dict[str, Any]:
         "v!": advanced_select_cmd,
         "l": list_cmd,
         "u": undo_cmd,
+        "U": redo_cmd,
         "s": substitute_cmd,
         "ip": projects_info_cmd,
         "ix": context_info_cmd,
         "vv": sub_select_cmd,
-        "it": tag_info_cmd
+        "it": tag_info_cmd,
+        "compact": compact_cmd
     }
 
     config = {
@@ -9,8 +9,9 @@ from time import sleep
 from typing import Dict, Any, Match
 
 from breadcrumbs.metrics_plugin import run_total, span, total_table
-from breadcrumbs.utils import span_to_delta
+from breadcrumbs.utils import macro_trigger, span_to_delta
 
+@macro_trigger("..today")
 def today_macro(text: str) -> str:
     """
     ..today
@@ -20,6 +21,7 @@ def today_macro(text: str) -> str:
     text = text.replace("..today", tmp)
     return text
 
+@macro_trigger("..delta")
 def delta_macro(text: str) -> str:
     """
     ..delta\\s(\\S*)
@@ -36,6 +38,7 @@ def delta_macro(text: str) -> str:
     text = sub(r"\.\.delta\s(\S*)", replace, text)
     return text
 
+@macro_trigger("..now")
 def now_macro(text: str) -> str:
     """
     ..now
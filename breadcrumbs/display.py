@@ -7,14 +7,14 @@ from typing import Any, List
 from rich.panel import Panel
 from pytodotxt import Task
 from rich.syntax import Syntax
-from breadcrumbs.lexer import TodotxtLexer
+from breadcrumbs.lexer import FastTodotxtLexer
 import readline
 # Wether to print in a undecorated form
 SIMPLE = True
 # To print debug info
 DEBUG = True
 # The todo lexer to Use
-lex = TodotxtLexer()
+lex = FastTodotxtLexer()
 
 # readline.parse_and_bind('tab: complete')
 # readline.parse_and_bind('set editing-mode vi')
@@ -4,6 +4,7 @@ This plugin consists of establishing the most basic display capabilities.
 
 from enum import Enum, auto
 from json import dumps
+import sys
 from typing import Dict, Any, Union, List
 from pytodotxt import Task, TodoTxt
 from rich.align import Align
@@ -12,12 +13,18 @@ from rich.panel import Panel
 from rich.table import Table
 
 from rich.console import Console, RenderableType
-from breadcrumbs.utils import easy_lex
+from breadcrumbs.utils import batch_safe, easy_lex
 
 # The rich console to use
 console = Console()
 # Is a json list being printed
 is_json_list = False
+# The text of the last prompt shown
+last_prompt = ""
+# The json stream records not written out yet
+json_stream_buffer: List[str] = list()
+# How many json stream records are written out at once
+JSON_STREAM_BATCH = 256
 
 def log(text: Any) -> None:
     """
@@ -29,6 +36,7 @@ def log(text: Any) -> None:
 
 class LogType(Enum):
     CRUMB = auto()
+    CRUMBS = auto()
     FIGURE = auto()
     INFO = auto()
     WARN = auto()
@@ -51,6 +59,11 @@ def debug_log(text: Any = "Default Text", err: Union[Exception, None] = None,
         log("<CRUMB>")
         tmp = easy_lex(text)
         log(tmp)
+    elif (ltype == LogType.CRUMBS):
+        for x in text:
+            log("<CRUMB>")
+            tmp = easy_lex(x)
+            log(tmp)
     elif (ltype == LogType.FIGURE):
         log("<FIGURE>")
         log(text)
@@ -89,6 +102,12 @@ def normal_log(text: Any = "Default Text", err: Union[Exception, None] = None,
         tmp = easy_lex(text.description)
         tmp_panel = Panel(tmp)
         console.print(tmp_panel)
+    elif (ltype == LogType.CRUMBS):
+        # One crumb a line, lexed as one block
+        if (text):
+            tmp = easy_lex("\n".join(x.description for x in text))
+            tmp_panel = Panel(tmp)
+            console.print(tmp_panel)
     elif (ltype == LogType.FIGURE):
         tmp = Align(text, align="center", vertical="middle")
         tmp_panel = Panel(tmp, border_style="blue", safe_box=False)
@@ -133,6 +152,10 @@ def json_log(text: Any = "Default Text", err: Union[Exception, None] = None,
         }
         tmp_json = dumps(tmp)
         print(tmp_json + ",")
+    elif (ltype == LogType.CRUMBS):
+        tmp_json = "".join(dumps({"_type": "crumb", "data": str(x)}) + ",\n"
+                           for x in text)
+        print(tmp_json, end="")
     elif (ltype == LogType.FIGURE):
         tmp = {
             "_type": "figure",
@@ -191,6 +214,96 @@ def json_log(text: Any = "Default Text", err: Union[Exception, None] = None,
         is_json_list = False
         print("]")
 
+def crumb_record(task: Task) -> Dict[str, Any]:
+    """
+    Breaks a crumb down into json friendly fields.
+
+    :param task: The crumb.
+    :return: The fields of the crumb.
+    """
+    def iso(x: Any) -> Union[str, None]:
+        return (x.isoformat() if (x is not None) else None)
+    return {
+        "text": str(task),
+        "description": task.description,
+        "priority": task.priority,
+        "archived": bool(task.is_completed),
+        "made": iso(task.creation_date),
+        "archived_on": iso(task.completion_date),
+        "projects": task.projects,
+        "contexts": task.contexts,
+        "tags": task.attributes
+    }
+
+def flush_json_stream() -> None:
+    """
+    Writes out the json stream records waiting in the buffer.
+    """
+    if (not json_stream_buffer):
+        return
+    sys.stdout.write("".join(json_stream_buffer))
+    sys.stdout.flush()
+    json_stream_buffer.clear()
+
+def json_stream_log(text: Any = "Default Text",
+                    err: Union[Exception, None] = None,
+                    ltype: LogType = LogType.INFO) -> None:
+    """
+    Logs a renderable as one line of json (NDJSON), so every record can be
+    read as soon as its line is. Records are written out in batches of
+    JSON_STREAM_BATCH, and at the end of each command, before a prompt and
+    on errors.
+
+    :param text: The object to log.
+    :param err: If present, an err to log.
+    :param ltype: The type of the object being logged.
+    """
+    if (ltype == LogType.CRUMB):
+        tmp = {
+            "_type": "crumb",
+            "data": crumb_record(text)
+        }
+    elif (ltype == LogType.CRUMBS):
+        json_stream_buffer.extend(
+            dumps({"_type": "crumb", "data": crumb_record(x)}) + "\n"
+            for x in text)
+        if (len(json_stream_buffer) >= JSON_STREAM_BATCH):
+            flush_json_stream()
+        return
+    elif (ltype == LogType.CLEAR):
+        tmp = {
+            "_type": "clear"
+        }
+    else:
+        tmp = {
+            "_type": ltype.name.lower(),
+            "data": str(text)
+        }
+        if (err is not None):
+            tmp["err"] = f"{type(err).__name__}: {err}"
+    json_stream_buffer.append(dumps(tmp) + "\n")
+    if ((len(json_stream_buffer) >= JSON_STREAM_BATCH)
+            or (ltype in (LogType.ERR, LogType.FATAL))):
+        flush_json_stream()
+
+def json_stream_prompt(text: str = "") -> str:
+    """
+    Writes out the waiting json stream records, then prompts the user for
+    input.
+
+    :param text: A question for the user.
+    :return: The user input.
+    """
+    flush_json_stream()
+    return prompt(text)
+
+@batch_safe
+def flush_json_stream_hook(conf: Dict[str, Any], loaf: TodoTxt) -> None:
+    """
+    Writes out the json stream records of a command once it is done.
+    """
+    flush_json_stream()
+
 def simple_log(text: Any = "Default Text", err: Union[Exception, None] = None,
                ltype: LogType = LogType.INFO) -> None:
     """
@@ -204,6 +317,9 @@ def simple_log(text: Any = "Default Text", err: Union[Exception, None] = None,
         print("<CRUMB>")
         tmp = text
         print(tmp)
+    elif (ltype == LogType.CRUMBS):
+        tmp = "".join(f"<CRUMB>\n{x}\n" for x in text)
+        print(tmp, end="")
     elif (ltype == LogType.FIGURE):
         print("<FIGURE>")
         print(text)
@@ -236,10 +352,25 @@ def prompt(text: str = "") -> str:
     :param text: A question for the user.
     :return: The user input.
     """
+    global last_prompt
     text = f" {text} 🡠  "
+    last_prompt = text
     ret = input(text)
     return ret
 
+def reprompt(text: Union[str, None] = None) -> None:
+    """
+    Draws the prompt the user is at again, along with what they typed so far.
+    Used after something was displayed while they were typing.
+
+    :param text: The prompt text, defaults to the last prompt shown.
+    """
+    if (text is None):
+        text = last_prompt
+    # readline is set up by the REPL, so it is there by the time this is used
+    import readline
+    print(text + readline.get_line_buffer(), end="", flush=True)
+
 def display_test_cmd(conf: Dict[str, Any], loaf: TodoTxt, args: str) -> bool:
     """
     - No args.
@@ -256,6 +387,8 @@ def display_test_cmd(conf: Dict[str, Any], loaf: TodoTxt, args: str) -> bool:
         profile["title"]("DISPLAY TEST")
         profile["crumb"](Task("(A) 1971-01-01 Example Crumb +test @debug tag:true"))
         profile["crumb"](Task("x (A) 1971-01-01 Example Crumb +test @debug tag:true"))
+        profile["crumbs"]([Task("1971-01-01 Example Crumb +test"),
+                           Task("1971-01-02 Another Crumb @debug tag:true")])
         profile["figure"](t)
         profile["info"]("Putting bread in oven...")
         profile["debug"]("Oven at 1000 degrees C.")
@@ -295,6 +428,7 @@ def load_plugin() -> Dict[str, Any]:
     display_settings = {
         "debug": {
             "crumb": lambda x: debug_log(x, ltype=LogType.CRUMB),
+            "crumbs": lambda x: debug_log(x, ltype=LogType.CRUMBS),
             "figure": lambda x: debug_log(x, ltype=LogType.FIGURE),
             "info": lambda x: debug_log(x, ltype=LogType.INFO),
             "debug": lambda x: debug_log(x, ltype=LogType.DEBUG),
@@ -303,10 +437,12 @@ def load_plugin() -> Dict[str, Any]:
             "fatal": lambda x: debug_log(x, ltype=LogType.FATAL),
             "clear": lambda : debug_log(ltype=LogType.CLEAR),
             "title": lambda x: debug_log(x, ltype=LogType.TITLE),
-            "prompt": prompt
+            "prompt": prompt,
+            "reprompt": reprompt
         },
         "normal": {
             "crumb": lambda x: normal_log(x, ltype=LogType.CRUMB),
+            "crumbs": lambda x: normal_log(x, ltype=LogType.CRUMBS),
             "figure": lambda x: normal_log(x, ltype=LogType.FIGURE),
             "info": lambda x: normal_log(x, ltype=LogType.INFO),
             "debug": lambda x: normal_log(x, ltype=LogType.DEBUG),
@@ -315,10 +451,12 @@ def load_plugin() -> Dict[str, Any]:
             "fatal": lambda x: normal_log(x, ltype=LogType.FATAL),
             "clear": lambda : normal_log(ltype=LogType.CLEAR),
             "title": lambda x: normal_log(x, ltype=LogType.TITLE),
-            "prompt": prompt
+            "prompt": prompt,
+            "reprompt": reprompt
         },
         "json": {
             "crumb": lambda x: json_log(x, ltype=LogType.CRUMB),
+            "crumbs": lambda x: json_log(x, ltype=LogType.CRUMBS),
             "figure": lambda x: json_log(x, ltype=LogType.FIGURE),
             "info": lambda x: json_log(x, ltype=LogType.INFO),
             "debug": lambda x: json_log(x, ltype=LogType.DEBUG),
@@ -327,10 +465,12 @@ def load_plugin() -> Dict[str, Any]:
             "fatal": lambda x: json_log(x, ltype=LogType.FATAL),
             "clear": lambda : json_log(ltype=LogType.CLEAR),
             "title": lambda x: json_log(x, ltype=LogType.TITLE),
-            "prompt": prompt
+            "prompt": prompt,
+            "reprompt": reprompt
         },
         "simple": {
             "crumb": lambda x: simple_log(x, ltype=LogType.CRUMB),
+            "crumbs": lambda x: simple_log(x, ltype=LogType.CRUMBS),
             "figure": lambda x: simple_log(x, ltype=LogType.FIGURE),
             "info": lambda x: simple_log(x, ltype=LogType.INFO),
             "debug": lambda x: simple_log(x, ltype=LogType.DEBUG),
@@ -339,10 +479,39 @@ def load_plugin() -> Dict[str, Any]:
             "fatal": lambda x: simple_log(x, ltype=LogType.FATAL),
             "clear": lambda : simple_log(ltype=LogType.CLEAR),
             "title": lambda x: simple_log(x, ltype=LogType.TITLE),
-            "prompt": input
+            "prompt": input,
+            "reprompt": lambda : reprompt("")
+        },
+        "json_stream": {
+            "crumb": lambda x: json_stream_log(x, ltype=LogType.CRUMB),
+            "crumbs": lambda x: json_stream_log(x, ltype=LogType.CRUMBS),
+            "figure": lambda x: json_stream_log(x, ltype=LogType.FIGURE),
+            "info": lambda x: json_stream_log(x, ltype=LogType.INFO),
+            "debug": lambda x: json_stream_log(x, ltype=LogType.DEBUG),
+            "warn": lambda x: json_stream_log(x, ltype=LogType.WARN),
+            "err": lambda x, y: json_stream_log(x, y, ltype=LogType.ERR),
+            "fatal": lambda x: json_stream_log(x, ltype=LogType.FATAL),
+            "clear": lambda : json_stream_log(ltype=LogType.CLEAR),
+            "title": lambda x: json_stream_log(x, ltype=LogType.TITLE),
+            "prompt": json_stream_prompt,
+            "reprompt": lambda : (flush_json_stream(), reprompt())
         },
         }
 
+    hooks = {
+        "INIT": [],
+        "PREMACRO": [],
+        "PRECMD": [],
+        "CMDERR": [],
+        "NULLOK": [],
+        "POSTCMD": [flush_json_stream_hook],
+        "EXIT": [],
+        "SAFEEXIT": [],
+        "FATALEXIT": [],
+        "PRINTCRUMB": [],
+        "PRINTFIGURE": [],
+    }
+
     commands = {
         "display-test": display_test_cmd
     }
@@ -350,6 +519,7 @@ def load_plugin() -> Dict[str, Any]:
     config = {
         'plugins': {"display": plugin_data},
         "display": display_settings,
+        "hooks": hooks,
         'commands': commands,
         'log': display_settings["normal"]
     }
@@ -2,39 +2,91 @@
 Defines a some fun addins in a plugin for the breadcrumbs system.
 """
 from itertools import filterfalse
-from typing import Dict, Any, Union
-import holidays
+from typing import Dict, Any, List, Union
 
 from pytodotxt import Task, TodoTxt
-from holidays import USA
 from random import randint, shuffle
-from randfacts import get_fact
-from cowsay import chars, get_output_string
 from rich.text import Text
-from text2emotion import get_emotion
-from better_profanity import profanity
 from time import time
 from rich._emoji_codes import EMOJI
-from deep_translator import MyMemoryTranslator
 
-from breadcrumbs.utils import add_task
+from breadcrumbs.utils import add_task, task_to_bare
 from breadcrumbs.metrics_plugin import run_total
 
+# The libraries below are slow to import, so they are only loaded the first
+# time a shenanigan needs them.
 # List of us holidays TODO make this more international
-holidays = USA()
+holiday_list: Any = None
 # List of fellas to say stuff
-fellas = list(chars.keys())
+fellas: Union[List[str], None] = None
+# The profanity filter.
+profanity: Any = None
 # The translator object.
-trans: Union[MyMemoryTranslator, None] = None
+trans: Any = None
 
-def init_translator_hook(conf: Dict[str, Any], loaf: TodoTxt) -> None:
+def get_holidays() -> Any:
     """
-    Sets up the translator used by lang_learn.
+    Gets the list of holidays, loading it on first use.
+
+    :return: The holidays, keyed by date.
+    """
+    global holiday_list
+    if (holiday_list is None):
+        from holidays import USA
+        holiday_list = USA()
+    return holiday_list
+
+def get_fellas() -> List[str]:
+    """
+    Gets the fellas that can say stuff, loading them on first use.
+
+    :return: The names of the fellas.
+    """
+    global fellas
+    if (fellas is None):
+        from cowsay import chars
+        fellas = list(chars.keys())
+    return fellas
+
+def get_profanity() -> Any:
+    """
+    Gets the profanity filter, loading it on first use.
+
+    :return: The profanity filter.
+    """
+    global profanity
+    if (profanity is None):
+        from better_profanity import profanity as tmp
+        profanity = tmp
+    return profanity
+
+def get_translator(conf: Dict[str, Any]) -> Any:
+    """
+    Gets the translator used by lang_learn, setting it up on first use.
+
+    :param conf: The final conf.
+    :return: The translator.
     """
     global trans
-    start_lang = conf['plugins']['fun']['lib']['home_lang']
-    end_lang = conf['plugins']['fun']['lib']['guest_lang']
-    trans = MyMemoryTranslator(source=start_lang, target=end_lang)
+    if (trans is None):
+        from deep_translator import MyMemoryTranslator
+        start_lang = conf['plugins']['fun']['lib']['home_lang']
+        end_lang = conf['plugins']['fun']['lib']['guest_lang']
+        trans = MyMemoryTranslator(source=start_lang, target=end_lang)
+    return trans
+
+def say(text: str) -> Text:
+    """
+    Has a random fella say something.
+
+    :param text: What to say.
+    :return: The fella saying it.
+    """
+    from cowsay import get_output_string
+    tmp = get_fellas()
+    shuffle(tmp)
+    msg = get_output_string(tmp[0], text)
+    return Text.from_ansi(msg, overflow="crop", no_wrap=True, justify="left")
 
 def silly_toast_hook(conf: Dict[str, Any], loaf: TodoTxt) -> None:
     """
@@ -50,7 +102,7 @@ def lang_learn(conf: Dict[str, Any], loaf: TodoTxt, last_crumb: Task) -> None:
     :param loaf: The loaf.
     :param last_crumb: The last crumb.
     """
-    tmp = trans.translate(text=last_crumb.bare_description())
+    tmp = get_translator(conf).translate(text=task_to_bare(last_crumb))
     if (len(tmp) < 5):
         return
     conf['log']['info'](f"{tmp} :globe_showing_europe-africa:.")
@@ -67,7 +119,8 @@ def swear_jar(conf: Dict[str, Any], loaf: TodoTxt, last_crumb_str: str) -> None:
     if ("swear_jar" in last_crumb_str):
         return
     crumb_split = last_crumb_str.split()
-    swear_vector = [profanity.contains_profanity(x) for x in crumb_split]
+    swear_vector = [get_profanity().contains_profanity(x)
+                    for x in crumb_split]
     swears = [x for x, y in zip(crumb_split, swear_vector) if (y)]
     for x in swears:
         add_task(loaf, f"swear_jar:1/{x}")
@@ -84,7 +137,7 @@ def party_indicator(conf: Dict[str, Any], loaf: TodoTxt, last_crumb: Task) -> No
     :param loaf: The loaf.
     :param last_crumb: The last crumb.
     """
-    tmp = holidays.get(last_crumb.creation_date)
+    tmp = get_holidays().get(last_crumb.creation_date)
     conf['log']['info'](f"Happy {tmp} :party_popper:.")
     do_holiday = False
 
@@ -115,14 +168,11 @@ def wise_words_of_the_past(conf: Dict[str, Any], loaf: TodoTxt, last_crumb: Task
     :param last_crumb: The last crumb.
     """
     h = len(loaf.tasks)
-    tmp = loaf.tasks[randint(0, h)].bare_description()
+    tmp = task_to_bare(loaf.tasks[randint(0, h)])
     if (len(tmp) < 3):
         return
     tmp += "\n -- You"
-    shuffle(fellas)
-    msg = get_output_string(fellas[0], tmp)
-    fig = Text.from_ansi(msg, overflow="crop", no_wrap=True, justify="left")
-    conf['log']['figure'](fig)
+    conf['log']['figure'](say(tmp))
 
 def facts_and_logic(conf: Dict[str, Any], loaf: TodoTxt, last_crumb_str: str) -> None:
     """
@@ -132,6 +182,7 @@ def facts_and_logic(conf: Dict[str, Any], loaf: TodoTxt, last_crumb_str: str) ->
     :param loaf: The loaf.
     :param last_crumb_str: A string of the last crumb.
     """
+    from randfacts import get_fact
     tmp = get_fact(filter_enabled=False)
     tmp_list = tmp.split()
     do_print = False
@@ -139,10 +190,7 @@ def facts_and_logic(conf: Dict[str, Any], loaf: TodoTxt, last_crumb_str: str) ->
         if ((x in last_crumb_str) and (len(x) > 2)):
             do_print = True
     if (do_print):
-        shuffle(fellas)
-        msg = get_output_string(fellas[0], tmp)
-        fig = Text.from_ansi(msg, overflow="crop", no_wrap=True, justify="left")
-        conf['log']['figure'](fig)
+        conf['log']['figure'](say(tmp))
 
 def auto_emote(conf: Dict[str, Any], loaf: TodoTxt, last_crumb_str: str) -> None:
     """
@@ -170,9 +218,9 @@ def silly_toast_cmd(conf: Dict[str, Any], loaf: TodoTxt, args: str) -> bool:
     last_crumb = loaf.tasks[-1]
     last_crumb_str = str(last_crumb)
     is_nice(conf, loaf, last_crumb_str)
-    if (profanity.contains_profanity(last_crumb_str)):
+    if (get_profanity().contains_profanity(last_crumb_str)):
         swear_jar(conf, loaf, last_crumb_str)
-    if ((last_crumb.creation_date in holidays)):
+    if ((last_crumb.creation_date in get_holidays())):
         party_indicator(conf, loaf, last_crumb)
     facts_and_logic(conf, loaf, last_crumb_str)
     wise_words_of_the_past(conf, loaf, last_crumb)
@@ -191,9 +239,9 @@ def silly_toast(conf: Dict[str, Any], loaf: TodoTxt) -> None:
     last_crumb = loaf.tasks[-1]
     last_crumb_str = str(last_crumb)
     is_nice(conf, loaf, last_crumb_str)
-    if (profanity.contains_profanity(last_crumb)):
+    if (get_profanity().contains_profanity(last_crumb)):
         swear_jar(conf, loaf, last_crumb_str)
-    if ((not randint(0, 40)) and (last_crumb.creation_date in holidays)):
+    if ((not randint(0, 40)) and (last_crumb.creation_date in get_holidays())):
         party_indicator(conf, loaf, last_crumb)
     if (not randint(0, 10)):
         facts_and_logic(conf, loaf, last_crumb_str)
@@ -231,7 +279,7 @@ def load_plugin() -> Dict[str, Any]:
     }
 
     hooks = {
-        "INIT": [init_translator_hook],
+        "INIT": [],
         "MOTD": [],
         "PREMACRO": [],
         "PRECMD": [],
@@ -9,12 +9,13 @@ from time import time
 from pytodotxt import Task, TodoTxt
 from rich.table import Table
 
-from breadcrumbs.utils import easy_lex, loaf_search, order_by_date, set_buffer, task_to_make_date
+from breadcrumbs.utils import FLUSH_LOCK, background_safe, easy_lex, loaf_search, order_by_date, set_buffer, show_crumbs, task_to_make_date
 
 
 def check_future(conf: Dict[str, Any], loaf: TodoTxt, date_str: str, cmd: bool = False) -> None:
     """
-    Prints future casted items as a list for a given date.
+    Prints future casted items as a list for a given date. FLUSH_LOCK is held
+    while the loaf is searched.
 
     :param date_str: An iso date to check for casts.
     :param cmd: Wether to run as a command or a hook.
@@ -29,15 +30,17 @@ def check_future(conf: Dict[str, Any], loaf: TodoTxt, date_str: str, cmd: bool =
         if (t_time > max_time):
             return True
         return False
-    res = loaf_search(loaf, archived=False)
-    res = list(filterfalse(filter, res))
+    with FLUSH_LOCK:
+        res = list(filterfalse(filter, loaf_search(loaf, archived=False)))
+        # What the reminder shows of each cast
+        rows = [(x.attributes["FUTURE"][0], (x.description or "<empty>"))
+                for x in res]
     span_text = max_time.isoformat(' ', 'minutes')
     if (cmd):
         order_by_date(res, "FUTURE")
         conf['log']['clear']()
         conf['log']['title'](f"FUTURE CASTS FOR {span_text}")
-        for x in res:
-            conf['log']['crumb'](x)
+        show_crumbs(conf, res)
         set_buffer(conf, res)
         if (not res):
             conf['log']['info'](f"No casts to {span_text}...")
@@ -51,14 +54,10 @@ def check_future(conf: Dict[str, Any], loaf: TodoTxt, date_str: str, cmd: bool =
             t = Table(title=f"Future Casts For {span_text}")
             t.add_column("Cast Date")
             t.add_column("Crumb Info")
-            if (not res):
+            if (not rows):
                 return
-            for x in res:
-                date_txt = x.attributes["FUTURE"]
-                des = x.description
-                if (not des):
-                    des = "<empty>"
-                t.add_row(date_txt[0], easy_lex(des))
+            for date_txt, des in rows:
+                t.add_row(date_txt, easy_lex(des))
             conf['log']['figure'](t)
 
 def check_future_cmd(conf: Dict[str, Any], loaf: TodoTxt, args: str) -> bool:
@@ -75,6 +74,7 @@ def check_future_cmd(conf: Dict[str, Any], loaf: TodoTxt, args: str) -> bool:
     check_future(conf, loaf, check_str, cmd=True)
     return False
 
+@background_safe
 def check_future_hook(conf: Dict[str, Any], loaf: TodoTxt) -> None:
     """
     Reminds the user every 30 minutes about items that have been future cast to
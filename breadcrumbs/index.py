@@ -0,0 +1,303 @@
+"""
+Module of in-memory secondary indexes over the crumbs in a loaf.
+"""
+
+from bisect import bisect_left, bisect_right, insort
+from dataclasses import dataclass
+from gc import disable, enable, isenabled
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Set, Tuple, Union
+
+from pytodotxt import Task, TodoTxt
+
+# The date used when a crumb has a date that can not be understood
+FALLBACK_DATE = datetime(1970, 1, 1)
+
+@dataclass
+class IndexEntry():
+    """
+    What a crumb was filed under the last time it was indexed.
+    """
+    # Is the crumb archived
+    archived: bool
+    # The A-Z priority char, None for no priority
+    priority: Union[str, None]
+    # The make datetime of the crumb
+    made: datetime
+    # The archive datetime of the crumb
+    stale: datetime
+    # The projects, contexts and tag keys found in the crumb
+    projects: List[str]
+    contexts: List[str]
+    tags: List[str]
+
+# Told about every crumb filed in or taken out of an index, with the index, the
+# crumb, what it was filed under before (None if it is new) and what it is
+# filed under now (None if it was taken out). A re-filed crumb is taken out,
+# then filed again. After a rebuild it is called once with no crumb.
+IndexListener = Callable[["LoafIndex", Union[Task, None],
+                          Union[IndexEntry, None], Union[IndexEntry, None]],
+                         None]
+
+class LoafIndex():
+    """
+    Secondary indexes kept over a loaf so a search only has to touch the
+    crumbs it returns. The index is filed by archive state, priority, make
+    date, archive date, project, context, and tag key.
+    """
+
+    def __init__(self, loaf: TodoTxt,
+                 make_date: Callable[[Task], datetime],
+                 archive_date: Callable[[Task], datetime],
+                 projects: Callable[[Task], List[str]] = lambda t: t.projects,
+                 contexts: Callable[[Task], List[str]] = lambda t: t.contexts,
+                 listeners: Union[List[IndexListener], None] = None
+                 ) -> None:
+        """
+        Builds the index for the given loaf.
+
+        :param loaf: The loaf to index.
+        :param make_date: Turns a crumb into its make datetime.
+        :param archive_date: Turns a crumb into its archive datetime.
+        :param projects: Turns a crumb into its projects.
+        :param contexts: Turns a crumb into its contexts.
+        :param listeners: Told about the crumbs filed and taken out.
+        """
+        self.loaf = loaf
+        self.make_date = make_date
+        self.archive_date = archive_date
+        self.get_projects = projects
+        self.get_contexts = contexts
+        self.listeners = (listeners if (listeners is not None) else list())
+        self.rebuild()
+
+    def rebuild(self) -> None:
+        """
+        Throws away the index and files every crumb in the loaf again.
+        """
+        self.tasks_ref = self.loaf.tasks
+        self.entries: Dict[Task, IndexEntry] = dict()
+        self.position: Dict[Task, int] = dict()
+        self.next_position = 0
+        self.by_id: Dict[int, Task] = dict()
+        self.archived: Dict[bool, Set[Task]] = {True: set(), False: set()}
+        self.priority: Dict[Union[str, None], Set[Task]] = dict()
+        self.made: List[Tuple[datetime, int]] = list()
+        self.stale: List[Tuple[datetime, int]] = list()
+        self.projects: Dict[str, Set[Task]] = dict()
+        self.contexts: Dict[str, Set[Task]] = dict()
+        self.tags: Dict[str, Set[Task]] = dict()
+        # The cyclic gc would walk every entry filed so far over and over
+        gc_on = isenabled()
+        disable()
+        self.building = True
+        for x in self.loaf.tasks:
+            self.add(x)
+        self.building = False
+        if (gc_on):
+            enable()
+        self.made.sort()
+        self.stale.sort()
+        self.notify(None, None, None)
+
+    def notify(self, task: Union[Task, None], old: Union[IndexEntry, None],
+               new: Union[IndexEntry, None]) -> None:
+        """
+        Tells the listeners about a crumb being filed or taken out.
+
+        :param task: The crumb, None after a rebuild.
+        :param old: What the crumb was filed under before.
+        :param new: What the crumb is filed under now.
+        """
+        for x in self.listeners:
+            x(self, task, old, new)
+
+    def sync(self) -> None:
+        """
+        Catches the index up with crumbs that were put straight into the loaf.
+        """
+        if ((self.tasks_ref is not self.loaf.tasks)
+                or (len(self.loaf.tasks) < len(self.entries))):
+            self.rebuild()
+            return
+        for x in self.loaf.tasks[len(self.entries):]:
+            if (x not in self.entries):
+                self.add(x)
+
+    def renumber(self) -> None:
+        """
+        Refreshes the loaf order of the crumbs after the loaf has been sorted.
+        """
+        self.position = {x: i for i, x in enumerate(self.loaf.tasks)}
+        self.next_position = len(self.position)
+
+    def _safe_date(self, getter: Callable[[Task], datetime],
+                   task: Task) -> datetime:
+        """
+        Runs a date getter, falling back to the epoch on bad crumbs.
+
+        :param getter: The date getter to run.
+        :param task: The crumb to get the date of.
+        :return: The datetime.
+        """
+        try:
+            ret = getter(task)
+        except Exception as e:
+            ret = FALLBACK_DATE
+        return ret
+
+    def add(self, task: Task) -> None:
+        """
+        Files a crumb in the index.
+
+        :param task: The crumb to file.
+        """
+        if (task in self.entries):
+            return
+        entry = IndexEntry(
+            archived=bool(task.is_completed),
+            priority=task.priority,
+            made=self._safe_date(self.make_date, task),
+            stale=self._safe_date(self.archive_date, task),
+            projects=self.get_projects(task),
+            contexts=self.get_contexts(task),
+            tags=list(task.attributes.keys()))
+        self.entries[task] = entry
+        if (task not in self.position):
+            self.position[task] = self.next_position
+            self.next_position += 1
+        self.by_id[id(task)] = task
+        self.archived[entry.archived].add(task)
+        self.priority.setdefault(entry.priority, set()).add(task)
+        if (self.building):
+            self.made.append((entry.made, id(task)))
+            self.stale.append((entry.stale, id(task)))
+        else:
+            insort(self.made, (entry.made, id(task)))
+            insort(self.stale, (entry.stale, id(task)))
+        for k in entry.projects:
+            self.projects.setdefault(k, set()).add(task)
+        for k in entry.contexts:
+            self.contexts.setdefault(k, set()).add(task)
+        for k in entry.tags:
+            self.tags.setdefault(k, set()).add(task)
+        if (not self.building):
+            self.notify(task, None, entry)
+
+    def remove(self, task: Task) -> None:
+        """
+        Takes a crumb out of the index.
+
+        :param task: The crumb to remove.
+        """
+        entry = self.entries.pop(task, None)
+        if (entry is None):
+            return
+        self.archived[entry.archived].discard(task)
+        self.priority[entry.priority].discard(task)
+        for dates, when in ((self.made, entry.made),
+                            (self.stale, entry.stale)):
+            i = bisect_left(dates, (when, id(task)))
+            if ((i < len(dates)) and (dates[i] == (when, id(task)))):
+                del dates[i]
+        for terms, keys in ((self.projects, entry.projects),
+                            (self.contexts, entry.contexts),
+                            (self.tags, entry.tags)):
+            for k in keys:
+                tmp = terms.get(k, set())
+                tmp.discard(task)
+                if (not tmp):
+                    terms.pop(k, None)
+        del self.by_id[id(task)]
+        del self.position[task]
+        self.notify(task, entry, None)
+
+    def update(self, task: Task) -> None:
+        """
+        Re-files a crumb that was changed in place.
+
+        :param task: The changed crumb.
+        """
+        if (task not in self.entries):
+            return
+        pos = self.position[task]
+        self.remove(task)
+        self.position[task] = pos
+        self.add(task)
+
+    def _date_range(self, dates: List[Tuple[datetime, int]],
+                    bounds: Tuple[datetime, datetime]) -> Set[Task]:
+        """
+        Bisects a sorted date list for the crumbs inside a span.
+
+        :param dates: The sorted date list to look in.
+        :param bounds: The inclusive start and end of the span.
+        :return: The crumbs in the span.
+        """
+        before_t, after_t = bounds
+        lo = bisect_left(dates, (before_t, -1))
+        hi = bisect_right(dates, (after_t, float("inf")))
+        return {self.by_id[x[1]] for x in dates[lo:hi]}
+
+    def query(self, archived: Union[bool, None] = None,
+              priority: Union[str, None] = None,
+              span: Union[Tuple[datetime, datetime], None] = None,
+              archived_span: Union[Tuple[datetime, datetime], None] = None
+              ) -> List[Task]:
+        """
+        Finds the crumbs matching all of the given keys. Keys set to None are
+        not considered.
+
+        :param archived: Is the crumb archived?
+        :param priority: A-Z priority char, "" for no priority.
+        :param span: Inclusive make datetime bounds.
+        :param archived_span: Inclusive archive datetime bounds.
+        :return: The matching crumbs in loaf order.
+        """
+        candidates: List[Set[Task]] = list()
+        if (archived is not None):
+            candidates.append(self.archived[bool(archived)])
+        if (priority is not None):
+            key = (priority.upper() if priority else None)
+            candidates.append(self.priority.get(key, set()))
+        if (span is not None):
+            candidates.append(self._date_range(self.made, span))
+        if (archived_span is not None):
+            candidates.append(self._date_range(self.stale, archived_span))
+        if (not candidates):
+            return list(self.loaf.tasks)
+        candidates.sort(key=len)
+        smallest, rest = candidates[0], candidates[1:]
+        res = [x for x in smallest if all((x in y) for y in rest)]
+        res.sort(key=self.position.__getitem__)
+        return res
+
+    def count_terms(self, terms: Dict[str, Set[Task]],
+                    field: str) -> Dict[str, int]:
+        """
+        Counts how often each project, context or tag is used by the unarchived
+        crumbs.
+
+        :param terms: The term index to count.
+        :param field: The name of the IndexEntry field holding the terms.
+        :return: A dict keyed by term and values are how many references.
+        """
+        active = self.archived[False]
+        ret = dict()
+        for k, v in terms.items():
+            count = sum(getattr(self.entries[x], field).count(k)
+                        for x in v if (x in active))
+            if (count):
+                ret[k] = count
+        return ret
+
+def reindex(indexes: Iterable[LoafIndex], task_list: List[Task]) -> None:
+    """
+    Re-files crumbs that were changed in place in every index holding them.
+
+    :param indexes: The indexes to update.
+    :param task_list: The changed crumbs.
+    """
+    for idx in indexes:
+        for task in task_list:
+            idx.update(task)
@@ -0,0 +1,205 @@
+"""
+Module of the operation journal kept next to a loaf file (<file>.journal).
+
+Every command that changes the loaf appends one record (a step) to the
+journal, listing what it did to which crumb line:
+
+- ["add", line] -> A crumb was added.
+- ["del", line] -> A crumb was taken out.
+- ["set", before, after] -> A crumb was changed in place.
+
+Appending a line is cheap, so each step is on disk as soon as the command is
+done, while the loaf file itself is only written as a checkpoint every so
+often. A checkpoint record notes which steps the loaf file holds. On start,
+the steps after the last checkpoint are played again onto the loaf.
+
+The steps are also what undo and redo walk back and forth over.
+"""
+
+from json import JSONDecodeError, dumps, loads
+from os import fsync, replace
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+from typing import Any, Dict, List, Tuple, Union
+
+# Bump when the layout of a record changes
+JOURNAL_VERSION = 1
+# How many steps are kept (for undo) when the journal is trimmed
+KEEP_STEPS = 200
+
+# An operation on the crumb lines of a loaf
+Op = List[str]
+
+def journal_path(path: Path) -> Path:
+    """
+    Gets where the journal of a loaf file lives.
+
+    :param path: The loaf file.
+    :return: The path of its journal.
+    """
+    return path.with_name(path.name + ".journal")
+
+def inverse(ops: List[Op]) -> List[Op]:
+    """
+    Gets the operations that take back a step.
+
+    :param ops: The operations of the step.
+    :return: The operations undoing it, in the order to apply them.
+    """
+    ret = list()
+    for x in reversed(ops):
+        if (x[0] == "add"):
+            ret.append(["del", x[1]])
+        elif (x[0] == "del"):
+            ret.append(["add", x[1]])
+        else:
+            ret.append(["set", x[2], x[1]])
+    return ret
+
+class Journal():
+    """
+    The journal of a loaf file, along with the undo and redo history found in
+    it.
+    """
+
+    def __init__(self, path: Path) -> None:
+        """
+        Reads the journal, if there is one.
+
+        :param path: Where the journal lives.
+        """
+        self.path = path
+        # The sequence number of the last record
+        self.seq = 0
+        # How many records are in the journal file
+        self.count = 0
+        # The last checkpoint record, None if there was none yet
+        self.checkpoint: Union[Dict[str, Any], None] = None
+        # The operations of the steps after the last checkpoint
+        self.tail: List[Op] = list()
+        # The steps that can be undone / redone, last one last
+        self.undo_steps: List[Tuple[int, List[Op]]] = list()
+        self.redo_steps: List[Tuple[int, List[Op]]] = list()
+        self.read()
+
+    def read(self) -> None:
+        """
+        Reads the records of the journal. A record cut short (Eg. by a crash
+        mid write) ends the journal and is cut off the file.
+        """
+        try:
+            data = self.path.read_bytes()
+        except OSError as e:
+            return
+        good = 0
+        for line in data.splitlines(keepends=True):
+            if (not line.endswith(b"\n")):
+                break
+            try:
+                record = loads(line)
+            except (JSONDecodeError, UnicodeDecodeError) as e:
+                break
+            good += len(line)
+            self.track(record)
+        if (good < len(data)):
+            with open(self.path, "r+b") as f:
+                f.truncate(good)
+
+    def track(self, record: Dict[str, Any]) -> None:
+        """
+        Takes note of a record read or written.
+
+        :param record: The record.
+        """
+        self.count += 1
+        self.seq = max(self.seq, record["seq"])
+        if (record.get("checkpoint", False)):
+            self.checkpoint = record
+            self.tail = list()
+            return
+        self.tail.extend(record["ops"])
+        if ("undo" in record):
+            if (self.undo_steps and (self.undo_steps[-1][0] == record["undo"])):
+                self.redo_steps.append(self.undo_steps.pop())
+        elif ("redo" in record):
+            if (self.redo_steps and (self.redo_steps[-1][0] == record["redo"])):
+                self.undo_steps.append(self.redo_steps.pop())
+        else:
+            self.undo_steps.append((record["seq"], record["ops"]))
+            self.redo_steps = list()
+
+    def write(self, record: Dict[str, Any]) -> None:
+        """
+        Appends a record to the journal, syncing it to disk.
+
+        :param record: The record.
+        """
+        with open(self.path, "ab") as f:
+            f.write(bytes(dumps(record, separators=(",", ":")) + "\n",
+                          "utf-8"))
+            f.flush()
+            fsync(f.fileno())
+        self.track(record)
+
+    def log(self, ops: List[Op], undo: Union[int, None] = None,
+            redo: Union[int, None] = None) -> None:
+        """
+        Records a step.
+
+        :param ops: What the step did.
+        :param undo: The step this takes back, if it is an undo.
+        :param redo: The step this does again, if it is a redo.
+        """
+        record: Dict[str, Any] = {"seq": self.seq + 1, "ops": ops}
+        if (undo is not None):
+            record["undo"] = undo
+        if (redo is not None):
+            record["redo"] = redo
+        self.write(record)
+
+    def mark_checkpoint(self, mtime: int, size: int) -> None:
+        """
+        Records that the loaf file now holds every step so far.
+
+        :param mtime: The modification time of the loaf file in ns.
+        :param size: The size of the loaf file in bytes.
+        """
+        self.write({"seq": self.seq, "checkpoint": True,
+                    "version": JOURNAL_VERSION, "mtime": mtime,
+                    "size": size})
+        if (self.count > (2 * KEEP_STEPS)):
+            self.trim()
+
+    def matches(self, mtime: int, size: int) -> bool:
+        """
+        Checks if the loaf file is the one the last checkpoint was taken of,
+        so the steps after it are surely not in it yet.
+
+        :param mtime: The modification time of the loaf file in ns.
+        :param size: The size of the loaf file in bytes.
+        :return: True if the file is the checkpointed one.
+        """
+        return ((self.checkpoint is not None)
+                and (self.checkpoint.get("version", None) == JOURNAL_VERSION)
+                and (self.checkpoint["mtime"] == mtime)
+                and (self.checkpoint["size"] == size))
+
+    def trim(self) -> None:
+        """
+        Safely (write, then move in place) rewrites the journal with only the
+        last KEEP_STEPS steps and the last checkpoint. The redo history is
+        dropped.
+        """
+        steps = self.undo_steps[-KEEP_STEPS:]
+        lines = [dumps({"seq": k, "ops": ops}, separators=(",", ":"))
+                 for k, ops in steps]
+        lines.append(dumps(self.checkpoint, separators=(",", ":")))
+        tmp = NamedTemporaryFile("wb", buffering=0, dir=self.path.parent,
+                                 delete=False, prefix=".tmp", suffix="~")
+        tmp.write(bytes("".join(x + "\n" for x in lines), "utf-8"))
+        fsync(tmp.fileno())
+        tmp.close()
+        replace(tmp.name, self.path)
+        self.undo_steps = steps
+        self.redo_steps = list()
+        self.count = len(lines)
@@ -3,11 +3,13 @@ The Lexer class used for this tool.
 """
 
 import re
+from collections import OrderedDict
+from typing import Iterator, List, Tuple
 
 from pygments.lexers import guess_lexer, get_lexer_by_name
-from pygments.lexer import RegexLexer, bygroups, default, include
+from pygments.lexer import Lexer, RegexLexer, bygroups, default, include
 from pygments.token import Text, Comment, Operator, Keyword, Name, String, \
-    Number, Generic, Literal, Punctuation
+    Number, Generic, Literal, Punctuation, Error, Whitespace
 from pygments.util import ClassNotFound
 
 class TodotxtLexer(RegexLexer):
@@ -114,3 +116,181 @@ class TodotxtLexer(RegexLexer):
             (r'\s+', IncompleteTaskText),
         ],
     }
+
+class FastTodotxtLexer(Lexer):
+    """
+    Gives the same tokens as TodotxtLexer, but splits the text on whitespace
+    once and tells what each word is by how it starts (+, @, (, a digit) or
+    if it holds a :, rather than trying each regex in turn for every word.
+    """
+
+    name = 'Todotxt (fast)'
+    aliases = []
+    filenames = []
+    mimetypes = []
+
+    # Splits text into words and the whitespace between them
+    split_regex = re.compile(r'(\s+)')
+    # Only needed for the first word(s) of a crumb
+    date_match = re.compile(TodotxtLexer.date_regex).match
+    # The letters a priority can have
+    priority_letters = frozenset("ABCDEFGHIJKLMNOPQRSTUVWXYZ")
+
+    def get_tokens_unprocessed(self, text: str
+                               ) -> Iterator[Tuple[int, object, str]]:
+        """
+        Lexes text.
+
+        :param text: The text to lex.
+        :return: The tokens, as (index, type, value).
+        """
+        # Words are at even indexes, the whitespace between them at odd ones.
+        # Two empty parts on the end save checking for it when looking ahead
+        parts = self.split_regex.split(text) + ["", ""]
+        date_match = self.date_match
+        n = len(parts) - 2
+        # The type of the text of the crumb being lexed, None at the start of
+        # a crumb
+        state = None
+        pos = 0
+        i = 0
+        while (i < n):
+            part = parts[i]
+            if (i % 2):
+                if (state is not None):
+                    k = part.rfind("\n")
+                    if (k < 0):
+                        yield pos, state, part
+                        pos += len(part)
+                        i += 1
+                        continue
+                    # The end of the crumb, along with any blank lines after
+                    yield pos, state, part[:(k + 1)]
+                    pos += k + 1
+                    part = part[(k + 1):]
+                    state = None
+                # Whitespace at the start of a crumb is not expected
+                for c in part:
+                    yield pos, (Whitespace if (c == "\n") else Error), c
+                    pos += 1
+                i += 1
+                continue
+            if (not part):
+                i += 1
+                continue
+            if (state is None):
+                state = TodotxtLexer.IncompleteTaskText
+                nxt = parts[i + 2]
+                m = None
+                if ((part == "x") and (parts[i + 1] == " ")):
+                    m = date_match(nxt)
+                if (m is not None):
+                    # A complete crumb, with one or two dates
+                    state = TodotxtLexer.CompleteTaskText
+                    yield pos, state, "x "
+                    yield (pos + 2), TodotxtLexer.Date, m.group()
+                    pos += 2 + m.end()
+                    i += 2
+                    part = nxt[m.end():]
+                    nxt = parts[i + 2]
+                    m = None
+                    if ((not part) and (parts[i + 1] == " ")):
+                        m = date_match(nxt)
+                    if (m is not None):
+                        yield pos, state, " "
+                        yield (pos + 1), TodotxtLexer.Date, m.group()
+                        pos += 1 + m.end()
+                        i += 2
+                        part = nxt[m.end():]
+                elif ((part[0] == "(") and (len(part) >= 3)
+                        and (part[1] in self.priority_letters)
+                        and (part[2] == ")")):
+                    yield pos, TodotxtLexer.Priority, part[:3]
+                    pos += 3
+                    m = None
+                    if ((len(part) == 3) and (parts[i + 1] == " ")):
+                        m = date_match(nxt)
+                    if (m is not None):
+                        yield pos, state, " "
+                        yield (pos + 1), TodotxtLexer.Date, m.group()
+                        pos += 1 + m.end()
+                        i += 2
+                        part = nxt[m.end():]
+                    else:
+                        part = part[3:]
+                else:
+                    m = date_match(part)
+                    if (m is not None):
+                        yield pos, TodotxtLexer.Date, m.group()
+                        pos += m.end()
+                        part = part[m.end():]
+                if (not part):
+                    i += 1
+                    continue
+            c = part[0]
+            if ((c == "@") and (len(part) > 1)):
+                yield pos, TodotxtLexer.Context, part
+            elif ((c == "+") and (len(part) > 1)):
+                yield pos, TodotxtLexer.Project, part
+            elif (":" in part):
+                yield pos, TodotxtLexer.Tag, part
+            else:
+                yield pos, state, part
+            pos += len(part)
+            i += 1
+
+# Splits text into crumb lines. Like the end of line rule of TodotxtLexer
+# (\s*\n), blank lines after a crumb go with it
+LINE_REGEX = re.compile(r"[^\n]*\S[^\n]*(?:\s*\n)?|[^\n]*\n|[^\n]+")
+
+class CachedLexer(Lexer):
+    """
+    Wraps a line based lexer (like TodotxtLexer, where each line is a crumb),
+    keeping the tokens of the last LEX_CACHE_SIZE lines it lexed. Lexing many
+    lines again (Eg. redrawing the crumb trail after an add) only runs the
+    wrapped lexer over the lines it has not seen.
+    """
+
+    # How many lines the token cache keeps
+    LEX_CACHE_SIZE = 4096
+
+    def __init__(self, lexer: Lexer, **options) -> None:
+        """
+        :param lexer: The lexer to wrap.
+        """
+        super().__init__(**options)
+        self.lexer = lexer
+        self.name = lexer.name
+        # The tokens of each line lexed, as (offset in the line, type, value)
+        self.cache: "OrderedDict[str, List[Tuple[int, object, str]]]" = (
+            OrderedDict())
+
+    def lex_line(self, line: str) -> List[Tuple[int, object, str]]:
+        """
+        Gets the tokens of a line.
+
+        :param line: The line, along with its newline.
+        :return: The tokens of the line, as (offset in the line, type, value).
+        """
+        ret = self.cache.get(line, None)
+        if (ret is not None):
+            self.cache.move_to_end(line)
+            return ret
+        ret = list(self.lexer.get_tokens_unprocessed(line))
+        self.cache[line] = ret
+        if (len(self.cache) > self.LEX_CACHE_SIZE):
+            self.cache.popitem(last=False)
+        return ret
+
+    def get_tokens_unprocessed(self, text: str
+                               ) -> Iterator[Tuple[int, object, str]]:
+        """
+        Lexes text a line at a time.
+
+        :param text: The text to lex.
+        :return: The tokens, as (index, type, value).
+        """
+        for m in LINE_REGEX.finditer(text):
+            pos = m.start()
+            for i, t, v in self.lex_line(m.group()):
+                yield (pos + i), t, v
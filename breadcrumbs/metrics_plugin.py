@@ -2,26 +2,239 @@
 Defines the metrics plugin for the breadcrumbs system.
 """
 
+from array import array
+from collections import OrderedDict
+from contextlib import nullcontext
+from dataclasses import dataclass, fields, is_dataclass
+from functools import wraps
 from json import loads
-from typing import Union, List, Tuple, Any, Dict
+from shutil import get_terminal_size
+from typing import (Union, List, Tuple, Any, Dict, Set, Iterable, Callable,
+                    Hashable)
 from rich.align import Align
 from rich.console import RenderableType
 from rich.table import Table
 from rich.text import Text
-from breadcrumbs.utils import loaf_search, task_to_make_date
-from re import search
+from breadcrumbs.index import IndexEntry, LoafIndex
+from breadcrumbs.rollup import (MetricSeries, TagRollup, read_rollups,
+                                write_rollups)
+from breadcrumbs.utils import (CHANGE_LISTENERS, FLUSH_LOCK, background_safe,
+                               get_index, parse_span)
 from datetime import timedelta, datetime, date
-import plotext as pt
+from pathlib import Path
 from itertools import pairwise
-from pytodotxt import TodoTxt
+from threading import Lock
+from pytodotxt import Task, TodoTxt
+
+@dataclass
+class MetricPoint():
+    """
+    One <tag>:<value> pair of a crumb. The <value> is read as <float>,
+    <float>/<category> or <category>.
+    """
+    # The make datetime of the crumb
+    made: datetime
+    # The value as written
+    text: str
+    # The <float> of the value, None if it has none
+    value: Union[float, None]
+    # The <category> of the value, None if it has none
+    category: Union[str, None]
 
 # Tracks the metrics
 METRICS_CACHE = dict()
 # Has metris run once
 METRICS_FIRST_RUN = True
+# The points of the unarchived crumbs using a metric tag, by tag then crumb.
+# Filled the first time a metric of the tag runs, then kept up to date as the
+# loaf index files and takes out crumbs
+TAG_POINTS: Dict[str, Dict[Task, List[MetricPoint]]] = dict()
+# The rollups of the metric tags, by tag. Read from the breadbox or summed
+# from TAG_POINTS when first needed, then kept up to date like TAG_POINTS
+ROLLUPS: Dict[str, TagRollup] = dict()
+# Where the rollups are kept in the breadbox
+ROLLUP_NAME = "metrics.rollup"
+# The tags whose crumbs changed since their metrics last ran
+DIRTY_TAGS: Set[str] = set()
+# The time window each metric last ran over, by metric function and tag (see
+# metric_window)
+METRIC_WINDOWS: Dict[Tuple[Callable, str], Hashable] = dict()
+# The loaf index TAG_POINTS and ROLLUPS follow
+TAG_INDEX: Union[LoafIndex, None] = None
+# The figures built lately, keyed by what they were built from (see
+# render_cached), least recently used first
+RENDER_CACHE: "OrderedDict[Hashable, RenderableType]" = OrderedDict()
+# How many figures RENDER_CACHE keeps
+RENDER_CACHE_SIZE = 64
+# Guards RENDER_CACHE, figures are also built on the background worker
+RENDER_LOCK = Lock()
 # Weeksdays as strings
 WEEKDAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
 
+def read_point(made: datetime, text: str) -> MetricPoint:
+    """
+    Reads the value of a <tag>:<value> pair.
+
+    :param made: The make datetime of the crumb.
+    :param text: The value.
+    :return: The point.
+    """
+    num, sep, cat = text.partition("/")
+    try:
+        value = float(num)
+    except ValueError as e:
+        return MetricPoint(made, text, None, text)
+    return MetricPoint(made, text, value, (cat if (sep) else None))
+
+def read_points(task: Task, entry: IndexEntry,
+                tags: Iterable[str]) -> Dict[str, List[MetricPoint]]:
+    """
+    Reads the <tag>:<value> pairs of a crumb in one pass, sorting the points
+    by tag.
+
+    :param task: The crumb.
+    :param entry: What the crumb is filed under.
+    :param tags: The tags to read the points of.
+    :return: The points of the given tags the crumb uses, by tag.
+    """
+    return {k: [read_point(entry.made, x) for x in v]
+            for k, v in task.attributes.items() if (k in tags)}
+
+def roll_points(rollup: TagRollup, points: List[MetricPoint],
+                sign: int = 1) -> None:
+    """
+    Adds the values of points to a rollup, or takes them back out.
+
+    :param rollup: The rollup.
+    :param points: The points.
+    :param sign: 1 to add the values, -1 to take them out.
+    """
+    for x in points:
+        if (x.value is not None):
+            rollup.put(x.made.date().isoformat(), x.value, x.category, sign)
+
+def follow_tags(loaf: TodoTxt, tags: Iterable[str]) -> LoafIndex:
+    """
+    Starts following metric tags. The crumbs using any of the tags not
+    followed yet are read in one pass.
+
+    :param loaf: The loaf the metrics run on.
+    :param tags: The tags.
+    :return: The index of the loaf.
+    """
+    global TAG_INDEX
+    idx = get_index(loaf)
+    if (idx is not TAG_INDEX):
+        TAG_POINTS.clear()
+        ROLLUPS.clear()
+        TAG_INDEX = idx
+    new = {x for x in tags if (x not in TAG_POINTS)}
+    if (not new):
+        return idx
+    for k in new:
+        TAG_POINTS[k] = dict()
+    candidates = set().union(*(idx.tags.get(k, set()) for k in new))
+    for x in candidates:
+        entry = idx.entries[x]
+        if (not entry.archived):
+            for k, v in read_points(x, entry, new).items():
+                TAG_POINTS[k][x] = v
+    return idx
+
+def tag_rollup(loaf: TodoTxt, tag: str) -> TagRollup:
+    """
+    Gets the rollup of a tag, summing it from the crumbs if there is none yet,
+    and marks the tag as up to date.
+
+    :param loaf: The loaf to look in.
+    :param tag: The tag.
+    :return: The rollup.
+    """
+    ret = ROLLUPS.get(tag, None)
+    if ((ret is None) or (TAG_INDEX is not get_index(loaf))):
+        # Also drops the rollups if the loaf index is not the one followed
+        follow_tags(loaf, [tag])
+        ret = TagRollup()
+        for x in TAG_POINTS[tag].values():
+            roll_points(ret, x)
+        ROLLUPS[tag] = ret
+    DIRTY_TAGS.discard(tag)
+    return ret
+
+def on_crumb_change(idx: LoafIndex, task: Union[Task, None],
+                    old: Union[IndexEntry, None],
+                    new: Union[IndexEntry, None]) -> None:
+    """
+    Keeps the points and rollups of the metric tags up to date as the loaf index changes,
+    marking the tags that changed.
+
+    :param idx: The index that changed.
+    :param task: The crumb filed or taken out, None if the index was rebuilt.
+    :param old: What the crumb was filed under before.
+    :param new: What the crumb is filed under now.
+    """
+    if (idx is not TAG_INDEX):
+        return
+    if (task is None):
+        TAG_POINTS.clear()
+        ROLLUPS.clear()
+        return
+    if ((old is not None) and (not old.archived)):
+        for k in old.tags:
+            points = TAG_POINTS.get(k, dict()).pop(task, None)
+            rollup = ROLLUPS.get(k, None)
+            if (points is not None):
+                DIRTY_TAGS.add(k)
+                if (rollup is not None):
+                    roll_points(rollup, points, -1)
+            elif ((rollup is not None) and (k not in TAG_POINTS)):
+                # What the crumb added to the rollup is not known, so the
+                # rollup is summed again when next needed
+                del ROLLUPS[k]
+                DIRTY_TAGS.add(k)
+    if ((new is not None) and (not new.archived)):
+        tmp = read_points(task, new, (TAG_POINTS.keys() | ROLLUPS.keys()))
+        for k, v in tmp.items():
+            if (k in TAG_POINTS):
+                TAG_POINTS[k][task] = v
+            if (k in ROLLUPS):
+                roll_points(ROLLUPS[k], v)
+            DIRTY_TAGS.add(k)
+
+def tag_points(loaf: TodoTxt, tag: str,
+               span: Union[str, None] = None) -> List[MetricPoint]:
+    """
+    Gets the points of the unarchived crumbs using a tag, and marks the tag as
+    up to date.
+
+    :param loaf: The loaf to look in.
+    :param tag: The tag.
+    :param span: If given, only crumbs made in the span (see loaf_search).
+    :return: The points in loaf order.
+    """
+    idx = follow_tags(loaf, [tag])
+    DIRTY_TAGS.discard(tag)
+    crumbs = list(TAG_POINTS[tag].items())
+    if (span is not None):
+        before_t, after_t = parse_span(span, datetime.now())
+        crumbs = [x for x in crumbs if (before_t <= x[1][0].made <= after_t)]
+    crumbs.sort(key=lambda x: idx.position[x[0]])
+    return [y for x in crumbs for y in x[1]]
+
+def is_stale(loaf: TodoTxt, tag: str) -> bool:
+    """
+    Checks if the crumbs using a tag changed since its metrics last ran.
+
+    :param loaf: The loaf the metrics run on.
+    :param tag: The tag.
+    :return: True if the metrics of the tag have to run again.
+    """
+    # Catches the index up, so crumbs put straight into the loaf are seen
+    idx = get_index(loaf)
+    return ((idx is not TAG_INDEX)
+            or ((tag not in TAG_POINTS) and (tag not in ROLLUPS))
+            or (tag in DIRTY_TAGS))
+
 def span(loaf, tag: str, opt: Dict[str, Any]) -> Union[List[RenderableType], None]:
     """
     - <span> -> A span to collect the metric over.
@@ -31,14 +244,8 @@ def span(loaf, tag: str, opt: Dict[str, Any]) -> Union[List[RenderableType], Non
       will be taken. (?h metrics/span).
     """
     span = opt.get("span", "1d-~")
-    rec = loaf_search(loaf, span=span,
-                      regex_str=(tag + r':\w*'), archived=False)
-    tmp = list()
-    for x in rec:
-        m = search((tag + r':(\w*)'), x.description)
-        if (m is None):
-            continue
-        tmp.append((m.groups()[0], task_to_make_date(x)))
+    with FLUSH_LOCK:
+        tmp = [(x.text, x.made) for x in tag_points(loaf, tag, span)]
     if (tmp == METRICS_CACHE.get(tag, list())):
         return None
     else:
@@ -61,24 +268,20 @@ def run_total(loaf, tag: str,
       - <float> -> The signed value to add to the total.
       - <category> -> A category to track the value in <float> to.
     """
-    rec = loaf_search(loaf, archived=False,
-                      regex_str=(tag + r':\w*'))
-    tmp = list()
-    for x in rec:
-        m = search((tag + r':(\S*)/(\S*)'), x.description)
-        if (m is None):
-            continue
-        tmp.append((float(m.groups()[0]), m.groups()[1], task_to_make_date(x)))
-    if (tmp == METRICS_CACHE.get(tag, list())):
+    time_limit = opt.get("time_limit", 40)
+    start = (datetime.now() - timedelta(days=time_limit)).date()
+    with FLUSH_LOCK:
+        rollup = tag_rollup(loaf, tag)
+        cat_data = sorted(rollup.category_totals().items())
+        run_data = rollup.running_totals(start)
+    tmp = [cat_data, run_data]
+    if ((not cat_data) or (tmp == METRICS_CACHE.get(tag, list()))):
         return None
     else:
         METRICS_CACHE[tag] = tmp
     ret = list()
-    cat_data = [(y, x) for x, y, z in tmp]
     ret.append(make_cat_ratio(cat_data, f"Heatmap of {tag} (All Time)", "Effect", "Source"))
-    run_data = [(z, x) for x, y, z in tmp]
-    time_limit = opt.get("time_limit", 40)
-    ret.append(make_running_total(run_data, time_limit, "Time", "Net Total",
+    ret.append(make_running_total(run_data, "Time", "Net Total",
                                     f"Net Change Over Time of {tag}"))
     return ret
 
@@ -96,23 +299,88 @@ def total_table(loaf, tag: str, opt: Dict[str, Any]) -> Union[List[str], None]:
       day are summed.
     """
     span = opt.get("span", "40d-~")
-    rec = loaf_search(loaf, span=span, archived=False,
-                      regex_str=(tag + r':\w*'))
-    tmp = list()
-    for x in rec:
-        m = search((tag + r':(\S*)'), x.description)
-        if (m is None):
-            continue
-        tmp.append((float(m.groups()[0]), task_to_make_date(x)))
-    if (tmp == METRICS_CACHE.get(tag, list())):
+    before_t, after_t = parse_span(span, datetime.now())
+    with FLUSH_LOCK:
+        tmp = tag_rollup(loaf, tag).day_totals(before_t.date(),
+                                               after_t.date())
+    if ((not tmp.days) or (tmp == METRICS_CACHE.get(tag, None))):
         return None
     else:
         METRICS_CACHE[tag] = tmp
     ret = list()
-    value_data = [(y, x) for x, y in tmp]
-    ret.append(make_value_table(value_data, f"Record of {tag} over {span}", opt))
+    ret.append(make_value_table(tmp, f"Record of {tag} over {span}", opt))
     return(ret)
 
+# The metric functions that hold FLUSH_LOCK only while they read the loaf
+LOCKING_METRICS = (span, run_total, total_table)
+
+def metric_window(func: Callable, opt: Dict[str, Any]) -> Hashable:
+    """
+    Works out the time window a metric covers as of now (to the minute). A
+    window relative to now (Eg. "2h-~") moves on as time does, so the metric
+    has to run again even if none of its crumbs changed.
+
+    :param func: The metric function.
+    :param opt: The options of the metric.
+    :return: The window, None if the metric does not cover a set window.
+    """
+    now = datetime.now().replace(second=0, microsecond=0)
+    if (func is span):
+        return parse_span(opt.get("span", "1d-~"), now)
+    if (func is total_table):
+        before_t, after_t = parse_span(opt.get("span", "40d-~"), now)
+        return (before_t.date(), after_t.date())
+    if (func is run_total):
+        return (now - timedelta(days=opt.get("time_limit", 40))).date()
+    return None
+
+def freeze(data: Any) -> Hashable:
+    """
+    Turns what a figure is built from into something that can key a dict.
+
+    :param data: The data (lists, dicts, arrays, dataclasses...).
+    :return: A hashable copy of the data.
+    """
+    if (isinstance(data, dict)):
+        return tuple((freeze(k), freeze(v)) for k, v in data.items())
+    if (isinstance(data, (list, tuple))):
+        return tuple(freeze(x) for x in data)
+    if (isinstance(data, array)):
+        return (data.typecode, data.tobytes())
+    if (is_dataclass(data)):
+        return (type(data).__name__,
+                tuple(freeze(getattr(data, x.name)) for x in fields(data)))
+    return data
+
+def render_cached(func: Callable[..., RenderableType]
+                  ) -> Callable[..., RenderableType]:
+    """
+    Decorator that keeps the figures a figure maker builds. The figure is
+    keyed by the arguments it was made from, the terminal size (which the
+    graphs are sized to) and the day (today is marked), so it is only built
+    again when one of those changed.
+
+    :param func: The figure maker.
+    :return: The caching figure maker.
+    """
+    @wraps(func)
+    def wrapper(*args: Any, **kwargs: Any) -> RenderableType:
+        key = (func.__name__, freeze(args), freeze(kwargs),
+               tuple(get_terminal_size()), date.today())
+        with RENDER_LOCK:
+            ret = RENDER_CACHE.get(key, None)
+            if (ret is not None):
+                RENDER_CACHE.move_to_end(key)
+                return ret
+        ret = func(*args, **kwargs)
+        with RENDER_LOCK:
+            RENDER_CACHE[key] = ret
+            if (len(RENDER_CACHE) > RENDER_CACHE_SIZE):
+                RENDER_CACHE.popitem(last=False)
+        return ret
+    return wrapper
+
+@render_cached
 def make_time_table(data: List[Tuple[str, datetime, datetime]]) -> RenderableType:
     """
     Makes a time table from data.
@@ -164,6 +432,7 @@ def get_time_spans(data: List[Tuple[str, datetime]]) -> List[Tuple[str, datetime
                 ret.append((name, *p))
     return ret
 
+@render_cached
 def make_cat_ratio(data: List[Tuple[str, float]],
                      title: str,
                      x_text: str,
@@ -187,6 +456,8 @@ def make_cat_ratio(data: List[Tuple[str, float]],
     data_tup.sort(key= lambda x: x[1])
     keys = [x[0] for x in data_tup]
     values = [x[1] for x in data_tup]
+    # plotext is slow to import, only load it once a graph is drawn
+    import plotext as pt
     pt.clf()
     pt.limit_size(True, False)
     pt.plot_size((pt.tw() // 2), (pt.th() // 3))
@@ -198,28 +469,23 @@ def make_cat_ratio(data: List[Tuple[str, float]],
     t.add_row(f"Graph of {x_text} vs {y_text}")
     return t
 
-def make_running_total(data: List[Tuple[datetime, float]],
-                         time_limit: int,
+@render_cached
+def make_running_total(data: MetricSeries,
                          x_text: str, y_text: str,
                          title: str) -> RenderableType:
     """
-    Takes a set of datetimes and generates a running total graph.
+    Takes a series of days and running totals and generates a running total
+    graph.
 
-    :param data: The sets.
+    :param data: The series.
     :param x_text: The x label
     :param y_text: The y label
     :param title: The name of the graph.
     :retrun: The printable.
     """
-    times = list()
-    values = list()
-    lower_limit = datetime.now() - (timedelta(days=time_limit))
-    running_total = 0
-    for t, delta in data:
-        running_total += delta
-        if (t >= lower_limit):
-            times.append(pt.datetime_to_string(t))
-            values.append(running_total)
+    import plotext as pt
+    times = [pt.datetime_to_string(datetime.fromordinal(x)) for x in data.days]
+    values = list(data.values)
     pt.clf()
     pt.limit_size(True, True)
     pt.plot_size((pt.tw() // 2), (pt.th() // 3))
@@ -231,19 +497,27 @@ def make_running_total(data: List[Tuple[datetime, float]],
     return t
 
 
-def make_value_table(data: List[Tuple[datetime, float]],
-                       title: str, opt: Dict[str, Any]) -> RenderableType:
+@render_cached
+def make_value_table(data: MetricSeries, title: str,
+                     opt: Dict[str, Any]) -> RenderableType:
     """
-    Takes a set of datetimes and generates a per day table..
+    Takes a series of days and values and generates a per day table. Values on
+    the same day are summed.
 
-    :param data: The sets.
+    :param data: The series.
     :param title: The name of the graph.
     :retrun: The printable.
     """
-    days = dict()
-    for d, v in data:
-        tmp = days.get(d.date(), 0)
-        days[d.date()] = (tmp + v)
+    first = min(data.days)
+    # Weeks start on a monday
+    day_start = date.fromordinal(first - date.fromordinal(first).weekday())
+    start = day_start.toordinal()
+    count = max(data.days) - start + 1
+    totals = array("d", bytes(8 * count))
+    has_value = bytearray(count)
+    for d, v in zip(data.days, data.values):
+        totals[d - start] += v
+        has_value[d - start] = 1
     comp_type = opt.get("good_is_low", False)
     if (comp_type):
         hi_color = ("[red]", "[/red]")
@@ -251,65 +525,44 @@ def make_value_table(data: List[Tuple[datetime, float]],
     else:
         low_color = ("[red]", "[/red]")
         hi_color = ("[green]", "[/green]")
-    midpoint = sum(days.values()) // 2
-    tmp_days = list(days.keys())
-    tmp_days.sort()
-    print_data = list()
-    while (tmp_days[0].weekday() != 0):
-        past_day = (tmp_days[0] - timedelta(days=1))
-        tmp_days = [past_day, *tmp_days]
-    day_count = tmp_days[0]
-    day_start = tmp_days[0]
-    while (tmp_days):
-        value = days.get(day_count, None)
-        if (value is None):
-            print_data.append((day_count.isoformat(), "∅"))
-        else:
-            print_data.append((day_count.isoformat(), str(value)))
-        try:
-            tmp_days.remove(day_count)
-        except Exception as e:
-            # Porbs not the most elegent way to do this
-            ...
-        day_count += timedelta(days=1)
+    midpoint = sum(totals) // 2
+    goal = opt.get("goal", None)
+    fail = opt.get("fail", None)
+    dont_do_streek = opt.get("dont_do_streak", False)
+    today = date.today().toordinal() - start
     rows  = list()
     tmp = list()
     streak = 0
-    for i, v in enumerate(print_data):
+    for i in range(count):
         if ((not (i%7)) and (i != 0)):
             rows.append(tmp)
             tmp = list()
-        try:
-            comp = float(v[1])
-        except Exception as e:
-            comp = None
-        if (comp is not None):
-            marks = "\n"
-            goal = opt.get("goal", None)
-            if (v[0] == date.today().isoformat()):
-                marks += ":ten-thirty: "
-            if (goal is not None):
-                if (int(goal) == int(comp)):
-                    marks += ":white_check_mark: "
-                    streak += 1
-                else:
-                    streak = 0
-            fail = opt.get("fail", None)
-            if (fail is not None):
-                if (int(fail) == int(comp)):
-                    marks += ":white_exclamation_mark: "
-            dont_do_streek = opt.get("dont_do_streak", False)
-            if (not dont_do_streek):
-                if (streak >= 3):
-                    marks += ":fast_forward: "
-            if (marks[-1] == " "):
-                marks = marks[:-1]
-            if (comp >= midpoint):
-                tmp.append(f"{v[0][5:]}\n{hi_color[0]}{v[1]}{hi_color[1]}{marks}")
+        day = date.fromordinal(start + i).isoformat()[5:]
+        if (not has_value[i]):
+            tmp.append(f"{day}\n∅\n ")
+            continue
+        comp = totals[i]
+        marks = "\n"
+        if (i == today):
+            marks += ":ten-thirty: "
+        if (goal is not None):
+            if (int(goal) == int(comp)):
+                marks += ":white_check_mark: "
+                streak += 1
             else:
-                tmp.append(f"{v[0][5:]}\n{low_color[0]}{v[1]}{low_color[1]}{marks}")
+                streak = 0
+        if (fail is not None):
+            if (int(fail) == int(comp)):
+                marks += ":white_exclamation_mark: "
+        if (not dont_do_streek):
+            if (streak >= 3):
+                marks += ":fast_forward: "
+        if (marks[-1] == " "):
+            marks = marks[:-1]
+        if (comp >= midpoint):
+            tmp.append(f"{day}\n{hi_color[0]}{comp}{hi_color[1]}{marks}")
         else:
-            tmp.append(f"{v[0][5:]}\n{v[1]}\n ")
+            tmp.append(f"{day}\n{low_color[0]}{comp}{low_color[1]}{marks}")
     rows.append(tmp)
     t = Table(title=title, show_edge=False)
     # t.add_column("🡣 ISO Week Number / Day 🡢 ")
@@ -361,22 +614,60 @@ def collect_metrics_cmd(conf: Dict[str, Any], loaf: TodoTxt, args: str) -> bool:
         collect_metrics(conf, loaf, cmd=True)
     return False
 
+def load_rollups_hook(conf: Dict[str, Any], loaf: TodoTxt) -> None:
+    """
+    Reads the rollups kept in the breadbox, if they were taken of the loaf
+    file as it is now.
+    """
+    global TAG_INDEX
+    try:
+        tmp = loaf.filename.stat()
+    except OSError as e:
+        return
+    rollups = read_rollups(Path(conf['breadbox']) / ROLLUP_NAME,
+                           tmp.st_mtime_ns, tmp.st_size)
+    idx = get_index(loaf)
+    if (idx is not TAG_INDEX):
+        TAG_POINTS.clear()
+        ROLLUPS.clear()
+        TAG_INDEX = idx
+    ROLLUPS.update(rollups)
+
+def save_rollups_hook(conf: Dict[str, Any], loaf: TodoTxt) -> None:
+    """
+    Keeps the rollups in the breadbox, along with the loaf file they are of.
+    """
+    if ((not ROLLUPS) or (TAG_INDEX is not get_index(loaf))):
+        return
+    tmp = loaf.filename.stat()
+    try:
+        write_rollups(Path(conf['breadbox']) / ROLLUP_NAME, ROLLUPS,
+                      tmp.st_mtime_ns, tmp.st_size)
+    except OSError as e:
+        # Missing rollups only cost summing them again on the next start
+        conf['log']['warn']("Could not keep the metric rollups", e)
+
+@background_safe
 def check_metrics_hook(conf: Dict[str, Any], loaf: TodoTxt) -> None:
     """
-    Informs the user about updated metrics.
+    Informs the user about updated metrics. Only the metrics whose tag is used
+    by a crumb that changed since they last ran, or whose time window moved on,
+    are collected again.
     """
     global METRICS_FIRST_RUN
     if (METRICS_FIRST_RUN):
         collect_metrics(conf, loaf, cmd=False, do_print=False)
         METRICS_FIRST_RUN = False
     else:
-        collect_metrics(conf, loaf, cmd=False)
+        collect_metrics(conf, loaf, cmd=False, stale_only=True)
 
 def collect_metrics(conf: Dict[str, Any], loaf: TodoTxt, tag: Union[None, str] = None,
                     opt_overide: Union[Dict[str, Any], None] =  None,
-                    cmd: bool = False, do_print: bool = True) -> None:
+                    cmd: bool = False, do_print: bool = True,
+                    stale_only: bool = False) -> None:
     """
     Finds all metrics in the loaf that need to be printed inline and prints them.
+    FLUSH_LOCK is held while the loaf is read, not while figures are built.
 
     :param conf: The final conf to process.
     :param loaf: The loaf to process.
@@ -385,20 +676,40 @@ def collect_metrics(conf: Dict[str, Any], loaf: TodoTxt, tag: Union[None, str] =
     metric.
     :param cmd: Clear cache and print as a command.
     :param do_print: Print or just render.
+    :param stale_only: Skip the metrics whose crumbs and time window did not
+    change since they last ran.
     """
     print_data = list()
     tmp = conf['plugins']['metrics']['lib']['metrics']
     if (tag is not None):
         tmp = [x for x in tmp if (tag == x[1])]
+    with FLUSH_LOCK:
+        if (stale_only):
+            tmp = [x for x in tmp
+                   if (is_stale(loaf, x[1])
+                       or (METRIC_WINDOWS.get((x[0], x[1]), None)
+                           != metric_window(x[0], x[2])))]
+        # Reads the crumbs of every tag in one pass, instead of one per
+        # metric. Tags with a rollup are left to it
+        follow_tags(loaf, {x[1] for x in tmp
+                           if ((cmd or x[3]) and (x[1] not in ROLLUPS))})
     for c in tmp:
         if (cmd):
             METRICS_CACHE[c[1]] = list()
         try:
             if (cmd or c[3]):
                 if ((opt_overide is not None) and (tag is not None)):
-                    tmp_print = c[0](loaf, c[1], opt_overide | c[2])
+                    opt = opt_overide | c[2]
                 else:
-                    tmp_print = c[0](loaf, c[1], c[2])
+                    opt = c[2]
+                window = metric_window(c[0], opt)
+                # Other metric functions may not hold FLUSH_LOCK while they
+                # read the loaf
+                lock = (nullcontext() if (c[0] in LOCKING_METRICS)
+                        else FLUSH_LOCK)
+                with lock:
+                    tmp_print = c[0](loaf, c[1], opt)
+                METRIC_WINDOWS[(c[0], c[1])] = window
             else:
                 continue
         except Exception as e:
@@ -426,7 +737,8 @@ def load_plugin() -> Dict[str, Any]:
 
     :return: The configuration of the plugin.
     """
-
+    if (on_crumb_change not in CHANGE_LISTENERS):
+        CHANGE_LISTENERS.append(on_crumb_change)
 
     plugin_data = {
         "author": "USER 1103",
@@ -445,13 +757,13 @@ def load_plugin() -> Dict[str, Any]:
     }
 
     hooks = {
-        "INIT": [check_metrics_hook],
+        "INIT": [load_rollups_hook, check_metrics_hook],
         "PREMACRO": [],
         "PRECMD": [],
         "CMDERR": [],
         "NULLOK": [check_metrics_hook],
         "POSTCMD": [],
-        "EXIT": [],
+        "EXIT": [save_rollups_hook],
         "SAFEEXIT": [],
         "FATALEXIT": [],
         "PRINTCRUMB": [],
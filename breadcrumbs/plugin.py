@@ -46,6 +46,9 @@ def load_plugin() -> Dict[str, Any]:
         "debug": {
             # Prints a crumb
             "crumb": "some_function(Task) -> None",
+            # Prints a list of crumbs at once (Eg. a selection), in one go
+            # rather than one crumb at a time
+            "crumbs": "some_function(List[Task]) -> None",
             # Prints a figure (non crumb data that is more complicated than
             # a single line of text)
             "figure": "some_function(Any) -> None",
@@ -64,7 +67,10 @@ def load_plugin() -> Dict[str, Any]:
             # print the title of the "screen" that is being used
             "title": "some_function(str) -> None",
             # print the title of the "screen" that is being used
-            "prompt": "some_function(str) -> str"
+            "prompt": "some_function(str) -> str",
+            # Draws the prompt the user is at again, after something was
+            # printed while they were typing
+            "reprompt": "some_function() -> None"
         },
         # Used under normal conditions
         "normal": {}, #Expects the same set as debug
@@ -72,6 +78,8 @@ def load_plugin() -> Dict[str, Any]:
         "json": {}, #Expects the same set as debug
         # Used in reduced text environment
         "simple": {}, #Expects the same set as debug
+        # Used to stream records (one json object per line) to other programs
+        "json_stream": {}, #Expects the same set as debug
         }
 
     # Hooks can be used to run functions when a given event happens
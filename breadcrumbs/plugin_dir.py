@@ -1,21 +1,37 @@
 """
-This module is a directory of internal plugins.
+This module is a directory of internal plugins. A plugin module is only
+imported once its plugin is loaded.
 """
 
-from breadcrumbs.display_plugin import load_plugin as display
-from breadcrumbs.core_plugin import load_plugin as core
-from breadcrumbs.future_plugin import load_plugin as future
-from breadcrumbs.metrics_plugin import load_plugin as metrics
-from breadcrumbs.default_macros_plugin import load_plugin as default_macros
-from breadcrumbs.fun_plugin import load_plugin as fun
+from importlib import import_module
+from typing import Any, Dict
+
+class LazyPlugin():
+    """
+    Stands in for the load_plugin function of an internal plugin, importing
+    the plugin module the first time it is called.
+    """
+
+    def __init__(self, module: str) -> None:
+        """
+        :param module: The dotted name of the plugin module.
+        """
+        self.module = module
+
+    def __call__(self) -> Dict[str, Any]:
+        """
+        Loads the plugin.
+
+        :return: The configuration of the plugin.
+        """
+        return import_module(self.module).load_plugin()
 
 # The directory
 directory = {
-    'display': display,
-    'core': core,
-    'future': future,
-    'metrics': metrics,
-    'default_macros': default_macros,
-    'fun': fun
+    'display': LazyPlugin("breadcrumbs.display_plugin"),
+    'core': LazyPlugin("breadcrumbs.core_plugin"),
+    'future': LazyPlugin("breadcrumbs.future_plugin"),
+    'metrics': LazyPlugin("breadcrumbs.metrics_plugin"),
+    'default_macros': LazyPlugin("breadcrumbs.default_macros_plugin"),
+    'fun': LazyPlugin("breadcrumbs.fun_plugin")
 }
-
@@ -0,0 +1,187 @@
+"""
+Module of the metric rollups kept in the breadbox (metrics.rollup).
+
+A rollup holds what the <float> values of the unarchived crumbs using a tag
+add up to per make day (and per category), so a metric over a long span or
+the whole history of a tag does not have to go through every crumb. The
+rollups are written along with the size and modification time of the loaf
+file they were taken of, and are only read back if the loaf file is still
+that file.
+"""
+
+from array import array
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass, field
+from datetime import date
+from itertools import accumulate
+from json import JSONDecodeError, dumps, loads
+from os import fsync, replace
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+from typing import Dict, List, Union
+
+# Bump when the layout of the rollup file changes
+ROLLUP_VERSION = 1
+
+@dataclass
+class MetricSeries():
+    """
+    A metric series held as columns: the days (as date ordinals) and a value
+    for each, in day order.
+    """
+    days: array = field(default_factory=lambda: array("l"))
+    values: array = field(default_factory=lambda: array("d"))
+
+    def since(self, start: date) -> "MetricSeries":
+        """
+        Cuts off the days before a day.
+
+        :param start: The first day to keep.
+        :return: The series from that day on.
+        """
+        i = bisect_left(self.days, start.toordinal())
+        return MetricSeries(self.days[i:], self.values[i:])
+
+    def until(self, end: date) -> "MetricSeries":
+        """
+        Cuts off the days after a day.
+
+        :param end: The last day to keep.
+        :return: The series up to that day.
+        """
+        i = bisect_right(self.days, end.toordinal())
+        return MetricSeries(self.days[:i], self.values[:i])
+
+@dataclass
+class TagRollup():
+    """
+    What the <float> values of the unarchived crumbs using a tag add up to.
+    Sums are kept as [sum, how many values], so a day with no values left
+    can be dropped.
+    """
+    # The sums by ISO make day
+    days: Dict[str, List[float]] = field(default_factory=dict)
+    # The sums of the values with a category, by ISO make day then category
+    categories: Dict[str, Dict[str, List[float]]] = field(default_factory=dict)
+    # The sum of each day, worked out when first needed
+    columns: Union[MetricSeries, None] = None
+    # The running total of the values with a category at the end of each day,
+    # worked out when first needed
+    prefix: Union[MetricSeries, None] = None
+
+    def put(self, day: str, value: float, category: Union[str, None],
+            sign: int = 1) -> None:
+        """
+        Adds a value to the sums, or takes it back out.
+
+        :param day: The ISO make day of the value.
+        :param value: The value.
+        :param category: The category of the value, if any.
+        :param sign: 1 to add the value, -1 to take it out.
+        """
+        tmp = self.days.setdefault(day, [0.0, 0])
+        tmp[0] += sign * value
+        tmp[1] += sign
+        if (tmp[1] <= 0):
+            del self.days[day]
+        if (category is not None):
+            cats = self.categories.setdefault(day, dict())
+            tmp = cats.setdefault(category, [0.0, 0])
+            tmp[0] += sign * value
+            tmp[1] += sign
+            if (tmp[1] <= 0):
+                del cats[category]
+            if (not cats):
+                del self.categories[day]
+        self.columns = None
+        self.prefix = None
+
+    def day_totals(self, start: date, end: date) -> MetricSeries:
+        """
+        Gets the sum of each day in a span.
+
+        :param start: The first day of the span.
+        :param end: The last day of the span.
+        :return: The days with values in the span and their sums.
+        """
+        if (self.columns is None):
+            days = sorted(self.days.keys())
+            self.columns = MetricSeries(
+                array("l", (date.fromisoformat(x).toordinal() for x in days)),
+                array("d", (self.days[x][0] for x in days)))
+        return self.columns.since(start).until(end)
+
+    def category_totals(self) -> Dict[str, float]:
+        """
+        Gets the sum of each category over all days.
+
+        :return: The sums by category.
+        """
+        ret: Dict[str, float] = dict()
+        for cats in self.categories.values():
+            for k, v in cats.items():
+                ret[k] = ret.get(k, 0) + v[0]
+        return ret
+
+    def running_totals(self, start: date) -> MetricSeries:
+        """
+        Gets the running total of the values with a category, from the first
+        day there is one.
+
+        :param start: The first day to return the running total of.
+        :return: The days from start with values and the running total at
+        the end of each.
+        """
+        if (self.prefix is None):
+            days = sorted(self.categories.keys())
+            sums = (sum(x[0] for x in self.categories[k].values())
+                    for k in days)
+            self.prefix = MetricSeries(
+                array("l", (date.fromisoformat(x).toordinal() for x in days)),
+                array("d", accumulate(sums)))
+        return self.prefix.since(start)
+
+def read_rollups(path: Path, mtime: int, size: int) -> Dict[str, TagRollup]:
+    """
+    Reads the rollups of a loaf file, if they were taken of the file as it
+    is now.
+
+    :param path: Where the rollups live.
+    :param mtime: The modification time of the loaf file in ns.
+    :param size: The size of the loaf file in bytes.
+    :return: The rollups by tag, empty if there are none that can be used.
+    """
+    try:
+        data = loads(path.read_text())
+    except (OSError, JSONDecodeError, UnicodeDecodeError) as e:
+        return dict()
+    if ((data.get("version", None) != ROLLUP_VERSION)
+            or (data.get("mtime", None) != mtime)
+            or (data.get("size", None) != size)):
+        return dict()
+    return {k: TagRollup(v["days"], v["categories"])
+            for k, v in data["tags"].items()}
+
+def write_rollups(path: Path, rollups: Dict[str, TagRollup], mtime: int,
+                  size: int) -> None:
+    """
+    Safely (write, then move in place) writes the rollups of a loaf file.
+
+    :param path: Where the rollups live.
+    :param rollups: The rollups by tag.
+    :param mtime: The modification time of the loaf file in ns.
+    :param size: The size of the loaf file in bytes.
+    """
+    data = {
+        "version": ROLLUP_VERSION,
+        "mtime": mtime,
+        "size": size,
+        "tags": {k: {"days": v.days, "categories": v.categories}
+                 for k, v in rollups.items()},
+    }
+    tmp = NamedTemporaryFile("wb", buffering=0, dir=path.parent,
+                             delete=False, prefix=".tmp", suffix="~")
+    tmp.write(bytes(dumps(data, separators=(",", ":")), "utf-8"))
+    fsync(tmp.fileno())
+    tmp.close()
+    replace(tmp.name, path)
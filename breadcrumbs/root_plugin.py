@@ -100,6 +100,7 @@ def load_plugin() -> Dict[str, Any]:
     display_settings = {
         "debug": {
             "crumb": null_function(name="display_settings.debug.crumb"),
+            "crumbs": null_function(name="display_settings.debug.crumbs"),
             "figure": null_function(name="display_settings.debug.figure"),
             "info": null_function(name="display_settings.debug.info"),
             "debug": null_function(name="display_settings.debug.debug"),
@@ -108,10 +109,12 @@ def load_plugin() -> Dict[str, Any]:
             "fatal": null_function(name="display_settings.debug.fatal"),
             "clear": null_function(name="display_settings.debug.clear"),
             "title": null_function(name="display_settings.debug.title"),
-            "prompt": null_function(name="display_settings.debug.prompt")
+            "prompt": null_function(name="display_settings.debug.prompt"),
+            "reprompt": null_function(name="display_settings.debug.reprompt")
         },
         "normal": {
             "crumb": null_function(name="display_settings.normal.crumb"),
+            "crumbs": null_function(name="display_settings.normal.crumbs"),
             "figure": null_function(name="display_settings.normal.figure"),
             "info": null_function(name="display_settings.normal.info"),
             "debug": null_function(name="display_settings.normal.debug"),
@@ -120,10 +123,12 @@ def load_plugin() -> Dict[str, Any]:
             "fatal": null_function(name="display_settings.normal.fatal"),
             "clear": null_function(name="display_settings.normal.clear"),
             "title": null_function(name="display_settings.normal.title"),
-            "prompt": null_function(name="display_settings.normal.prompt")
+            "prompt": null_function(name="display_settings.normal.prompt"),
+            "reprompt": null_function(name="display_settings.normal.reprompt")
         },
         "json": {
             "crumb": null_function(name="display_settings.json.crumb"),
+            "crumbs": null_function(name="display_settings.json.crumbs"),
             "figure": null_function(name="display_settings.json.figure"),
             "info": null_function(name="display_settings.json.info"),
             "debug": null_function(name="display_settings.json.debug"),
@@ -132,10 +137,12 @@ def load_plugin() -> Dict[str, Any]:
             "fatal": null_function(name="display_settings.json.fatal"),
             "clear": null_function(name="display_settings.json.clear"),
             "title": null_function(name="display_settings.json.title"),
-            "prompt": null_function(name="display_settings.json.prompt")
+            "prompt": null_function(name="display_settings.json.prompt"),
+            "reprompt": null_function(name="display_settings.json.reprompt")
         },
         "simple": {
             "crumb": null_function(name="display_settings.simple.crumb"),
+            "crumbs": null_function(name="display_settings.simple.crumbs"),
             "figure": null_function(name="display_settings.simple.figure"),
             "info": null_function(name="display_settings.simple.info"),
             "debug": null_function(name="display_settings.simple.debug"),
@@ -144,7 +151,22 @@ def load_plugin() -> Dict[str, Any]:
             "fatal": null_function(name="display_settings.simple.fatal"),
             "clear": null_function(name="display_settings.simple.clear"),
             "title": null_function(name="display_settings.simple.title"),
-            "prompt": null_function(name="display_settings.simple.prompt")
+            "prompt": null_function(name="display_settings.simple.prompt"),
+            "reprompt": null_function(name="display_settings.simple.reprompt")
+        },
+        "json_stream": {
+            "crumb": null_function(name="display_settings.json_stream.crumb"),
+            "crumbs": null_function(name="display_settings.json_stream.crumbs"),
+            "figure": null_function(name="display_settings.json_stream.figure"),
+            "info": null_function(name="display_settings.json_stream.info"),
+            "debug": null_function(name="display_settings.json_stream.debug"),
+            "warn": null_function(name="display_settings.json_stream.warn"),
+            "err": null_function(name="display_settings.json_stream.err"),
+            "fatal": null_function(name="display_settings.json_stream.fatal"),
+            "clear": null_function(name="display_settings.json_stream.clear"),
+            "title": null_function(name="display_settings.json_stream.title"),
+            "prompt": null_function(name="display_settings.json_stream.prompt"),
+            "reprompt": null_function(name="display_settings.json_stream.reprompt")
         }
     }
 
@@ -183,6 +205,9 @@ def load_plugin() -> Dict[str, Any]:
         'input_post_macro': "",
         'cmd': "",
         'args': "",
+        'batch': False,
+        'background': False,
+        'page': 0,
         'err': Exception("If you are seeing this, something has gone *very* wrong.")
     }
 
@@ -200,8 +225,11 @@ def load_plugin() -> Dict[str, Any]:
         'default_time': '06-28',
         'default_span': '1d-~',
         'default_sequence': 'n-1d',
+        'loaf_segments': False,
+        'hot_days': 40,
         'buffers': buffers,
         'editor': "vim %P",
+        'page_size': 100,
         'log': display_settings["normal"],
         'macros': macros
     }
@@ -292,4 +320,3 @@ def collect_config(p: Progress) -> Dict[str, Any]:
         p.advance(t3, t3_left)
     p.update(t3, description="⮡ Loaded Config.")
     return final_conf
-
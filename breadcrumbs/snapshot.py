@@ -0,0 +1,289 @@
+"""
+Module that keeps a binary snapshot of a parsed loaf file next to it
+(<file>.snap), so the file does not have to be parsed again on every start.
+
+A snapshot holds the already split up crumbs (text, dates, tags and the
+cached fields worked out from them). It is only used while the file it was
+taken from is unchanged. As new crumbs are only ever appended to a loaf file,
+a snapshot of the start of a file still holds, and only the new lines at the
+end of the file have to be parsed.
+
+A snapshot may come from anywhere a breadbox does (Eg. a repo checked out
+with a .breadbox in it), so it is plain json: a header line (version, stamp
+of the file, line separator), then a line with the crumbs. The crumbs are
+only read once the header is found to match the file, and only ever become
+strings, numbers, lists, tuples and dates.
+"""
+
+from dataclasses import asdict, dataclass
+from datetime import date, datetime
+from gc import disable, enable, isenabled
+from hashlib import blake2b
+from io import BytesIO, TextIOWrapper
+from json import dumps, loads
+from os import replace
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+from typing import Any, Dict, List, Tuple, Union
+
+from pytodotxt import Task
+from pytodotxt.todotxt import TodoTxtParser
+
+# Bump when the layout of a snapshot (or of a Task) changes
+SNAPSHOT_VERSION = 2
+# How many lines past the end of a snapshot may be parsed before the snapshot
+# is taken again
+REFRESH_TAIL = 200
+# The parts of a crumb kept in a snapshot as they are, in the order they are
+# stored. The dates and the cached fields follow them
+TASK_FIELDS = ("description", "is_completed", "priority", "_raw",
+               "_attributes")
+
+@dataclass
+class FileStamp():
+    """
+    What a loaf file looked like when it was read.
+    """
+    # The modification time of the file in ns
+    mtime: int
+    # The size of the file in bytes
+    size: int
+    # The blake2b digest of the file
+    digest: str
+    # Does the file end in exactly one line break, so lines appended to it
+    # parse the same as they would as part of the whole file
+    appendable: bool
+
+def snapshot_path(path: Path) -> Path:
+    """
+    Gets where the snapshot of a loaf file lives.
+
+    :param path: The loaf file.
+    :return: The path of its snapshot.
+    """
+    return path.with_name(path.name + ".snap")
+
+def stamp_data(path: Path, data: bytes, encoding: str) -> FileStamp:
+    """
+    Stamps the contents of a loaf file.
+
+    :param path: The loaf file.
+    :param data: The contents of the file.
+    :param encoding: The encoding of the file.
+    :return: The stamp of the file.
+    """
+    text = str(data, encoding)
+    return FileStamp(mtime=path.stat().st_mtime_ns,
+                     size=len(data),
+                     digest=blake2b(data).hexdigest(),
+                     appendable=(data.endswith(b"\n")
+                                 and ((text.rstrip() + "\n")
+                                      == text.replace("\r\n", "\n"))))
+
+def parse_data(parser: TodoTxtParser, data: bytes,
+               encoding: str) -> List[Task]:
+    """
+    Parses the contents of a loaf file the way TodoTxt.parse does.
+
+    :param parser: The parser of the loaf.
+    :param data: The contents of the file.
+    :param encoding: The encoding of the file.
+    :return: The parsed crumbs.
+    """
+    return parser.parse_stream(TextIOWrapper(BytesIO(data), encoding=encoding))
+
+def encode_value(x: Any) -> Any:
+    """
+    Turns a cached field (or its key) into something json can hold.
+
+    :param x: The value, made of None, bools, numbers, strings, dates, lists
+    and tuples.
+    :return: The json friendly value.
+    """
+    if ((x is None) or isinstance(x, (bool, int, float, str))):
+        return x
+    if (isinstance(x, datetime)):
+        return {"t": x.isoformat()}
+    if (isinstance(x, date)):
+        return {"d": x.isoformat()}
+    if (isinstance(x, tuple)):
+        return {"u": [encode_value(y) for y in x]}
+    if (isinstance(x, list)):
+        return [encode_value(y) for y in x]
+    raise TypeError(f"Can not keep a {type(x).__name__} in a snapshot.")
+
+def decode_value(x: Any) -> Any:
+    """
+    Turns a value written by encode_value back into what it was.
+
+    :param x: The json value.
+    :return: The value.
+    """
+    if (isinstance(x, list)):
+        return [decode_value(y) for y in x]
+    if (not isinstance(x, dict)):
+        return x
+    if ("t" in x):
+        return datetime.fromisoformat(x["t"])
+    if ("d" in x):
+        return date.fromisoformat(x["d"])
+    return tuple(decode_value(y) for y in x["u"])
+
+def encode_date(x: Union[date, None]) -> Union[str, None]:
+    """
+    :param x: A date of a crumb.
+    :return: The date as an ISO string, with a T if it has a time.
+    """
+    return (x.isoformat() if (x is not None) else None)
+
+def decode_date(x: Union[str, None]) -> Union[date, None]:
+    """
+    :param x: A date written by encode_date.
+    :return: The date (or datetime).
+    """
+    if (x is None):
+        return None
+    if ("T" in x):
+        return datetime.fromisoformat(x)
+    return date.fromisoformat(x)
+
+def read_snapshot(path: Path) -> Union[Tuple[Dict[str, Any], bytes], None]:
+    """
+    Reads the header of the snapshot of a loaf file. The crumbs are left as
+    they are until the header is found to match the file (see read_rows).
+
+    :param path: The loaf file.
+    :return: The header and the crumbs, None if there is no usable snapshot.
+    """
+    try:
+        data = snapshot_path(path).read_bytes()
+        head, rows = data.split(b"\n", 1)
+        ret = loads(head)
+        if ((not isinstance(ret, dict))
+                or (ret.get("version", None) != SNAPSHOT_VERSION)):
+            return None
+        ret["stamp"] = FileStamp(**ret["stamp"])
+    except Exception as e:
+        return None
+    return (ret, rows)
+
+def read_rows(rows: bytes) -> List[Task]:
+    """
+    Makes the crumbs kept in a snapshot.
+
+    :param rows: The crumb line of the snapshot.
+    :return: The crumbs, in file order.
+    """
+    # The cyclic gc would walk every crumb read so far over and over
+    gc_on = isenabled()
+    disable()
+    try:
+        ret = list()
+        for i, row in enumerate(loads(rows)):
+            x = Task.__new__(Task)
+            x.__dict__.update(zip(TASK_FIELDS, row))
+            x.creation_date = decode_date(row[-3])
+            x.completion_date = decode_date(row[-2])
+            if (row[-1] is not None):
+                # The stamp the cache was taken with is the crumb itself
+                stamp = (x.description, x.creation_date, x.completion_date,
+                         x.is_completed)
+                x._crumb_fields = (stamp, {decode_value(k): decode_value(v)
+                                           for k, v in row[-1]})
+            x.linenr = i
+            x.todotxt = None
+            ret.append(x)
+    finally:
+        if (gc_on):
+            enable()
+    return ret
+
+def write_snapshot(path: Path, task_list: List[Task], stamp: FileStamp,
+                   linesep: str) -> None:
+    """
+    Safely (write, then move in place) takes a snapshot of a loaf file.
+
+    :param path: The loaf file.
+    :param task_list: The crumbs of the file, in file order, as they were
+    parsed.
+    :param stamp: The stamp of the file the crumbs were read from.
+    :param linesep: The line separator found in the file.
+    """
+    gc_on = isenabled()
+    disable()
+    rows = list()
+    for x in task_list:
+        # Split out the tags so they are kept with the snapshot
+        x.attributes
+        row = [x.__dict__.get(k, None) for k in TASK_FIELDS]
+        row.append(encode_date(x.creation_date))
+        row.append(encode_date(x.completion_date))
+        cache = x.__dict__.get("_crumb_fields", None)
+        fields = None
+        if (cache is not None):
+            try:
+                fields = [[encode_value(k), encode_value(v)]
+                          for k, v in cache[1].items()]
+            except TypeError as e:
+                # Worked out again when needed
+                fields = None
+        row.append(fields)
+        rows.append(row)
+    head = dumps({"version": SNAPSHOT_VERSION, "stamp": asdict(stamp),
+                  "linesep": linesep})
+    data = bytes(head + "\n" + dumps(rows, separators=(",", ":")), "utf-8")
+    if (gc_on):
+        enable()
+    try:
+        tmp = NamedTemporaryFile("wb", buffering=0, dir=path.parent,
+                                 delete=False, prefix=".tmp", suffix="~")
+        tmp.write(data)
+        tmp.close()
+        replace(tmp.name, snapshot_path(path))
+    except OSError as e:
+        # A missing snapshot only costs a parse on the next start
+        pass
+
+def load_tasks(path: Path, parser: TodoTxtParser, encoding: str
+               ) -> Tuple[List[Task], str, FileStamp, bool]:
+    """
+    Reads the crumbs of a loaf file, from its snapshot when the file has not
+    changed since (or only had crumbs appended), parsing it otherwise.
+
+    :param path: The loaf file.
+    :param parser: The parser of the loaf.
+    :param encoding: The encoding of the file.
+    :return: The crumbs in file order, the line separator of the file, the
+    stamp of the file and whether the snapshot should be taken again.
+    """
+    data = path.read_bytes()
+    stamp = stamp_data(path, data, encoding)
+    snap = read_snapshot(path)
+    old: Union[FileStamp, None] = None
+    if (snap is not None):
+        old = snap[0]["stamp"]
+    if (old is None):
+        task_list = parse_data(parser, data, encoding)
+        return (task_list, parser.linesep, stamp, True)
+    if ((old.size == stamp.size) and (old.mtime == stamp.mtime)
+            and (old.digest == stamp.digest)):
+        tail = b""
+    elif (old.appendable
+            and (blake2b(data[:old.size]).hexdigest() == old.digest)):
+        tail = data[old.size:]
+    else:
+        task_list = parse_data(parser, data, encoding)
+        return (task_list, parser.linesep, stamp, True)
+    try:
+        task_list = read_rows(snap[1])
+    except Exception as e:
+        task_list = parse_data(parser, data, encoding)
+        return (task_list, parser.linesep, stamp, True)
+    linesep = snap[0]["linesep"]
+    new = list()
+    if (str(tail, encoding).strip()):
+        new = parse_data(parser, tail, encoding)
+        for x in new:
+            x.linenr += len(task_list)
+        task_list.extend(new)
+    return (task_list, linesep, stamp, (len(new) > REFRESH_TAIL))
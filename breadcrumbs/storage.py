@@ -0,0 +1,402 @@
+"""
+Module that keeps track of what part of a loaf is already on disk, so saving
+only has to write what changed.
+
+A loaf can be split into an active segment (the loaf file itself) and cold,
+per month segments (<breadbox>/segments/<yyyy-mm>.loaf) holding old archived
+crumbs. Cold segments are only read once a search reaches them.
+
+Every write is synced to disk before the next one starts, in an order where
+a crash can at worst leave a crumb in two files, never in none.
+"""
+
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+from os import O_RDONLY, close, fsync, open as os_open, replace
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+from typing import Dict, List, Set, Tuple, Union
+
+from pytodotxt import Task, TodoTxt
+
+from breadcrumbs.journal import Journal, Op
+from breadcrumbs.snapshot import load_tasks, write_snapshot
+
+# Crumbs with missing dates fall on this day, so spans starting before it can
+# reach any segment
+UNDATED_END = datetime(1970, 1, 2)
+
+@dataclass
+class Segment():
+    """
+    A cold, per month part of a loaf.
+    """
+    # The month of the segment, yyyy-mm
+    name: str
+    # Where the segment lives on disk
+    path: Path
+    # Have the crumbs of the segment been read into the loaf
+    loaded: bool = False
+    # Crumbs that must be appended to the segment file on the next save
+    pending: List[Task] = field(default_factory=list)
+
+    def bounds(self) -> Tuple[datetime, datetime]:
+        """
+        Gets the start of the month of the segment and the start of the next.
+
+        :return: The start and end of the segment.
+        """
+        year, month = (int(x) for x in self.name.split("-"))
+        start = datetime(year, month, 1)
+        if (month == 12):
+            end = datetime(year + 1, 1, 1)
+        else:
+            end = datetime(year, month + 1, 1)
+        return (start, end)
+
+    def reaches(self, span: Union[Tuple[datetime, datetime], None]) -> bool:
+        """
+        Checks if a search span could match crumbs in the segment.
+
+        :param span: Inclusive datetime bounds, None for any time.
+        :return: True if the segment has to be read for the span.
+        """
+        if (span is None):
+            return True
+        before_t, after_t = span
+        if (before_t < UNDATED_END):
+            return True
+        start, end = self.bounds()
+        return ((before_t < end) and (after_t >= start))
+
+def crumb_line(task: Task) -> str:
+    """
+    Turns a crumb into its line in a loaf file. Unlike str(task), an archived
+    crumb that only has one date (read as the completion date) keeps it.
+
+    :param task: The crumb.
+    :return: The line, without a line separator.
+    """
+    ret = str(task)
+    if (task.is_completed and (task.creation_date is None)
+            and (task.completion_date is not None)):
+        day = task.completion_date.strftime(Task.DATE_FMT)
+        ret = " ".join(["x", day, *ret.split(" ")[1:]])
+    return ret
+
+def sync_dir(path: Path) -> None:
+    """
+    Syncs a directory, so a file just moved into it stays there on a crash.
+
+    :param path: The directory.
+    """
+    fd = os_open(path, O_RDONLY)
+    try:
+        fsync(fd)
+    finally:
+        close(fd)
+
+def write_tasks(path: Path, task_list: List[Task], linesep: str,
+                encoding: str) -> None:
+    """
+    Safely (write, then move in place) writes crumbs to a file ordered by
+    line number, the same way TodoTxt.save does. Each crumb keeps the line it
+    was written as (Task._line).
+
+    :param path: The file to write.
+    :param task_list: The crumbs to write.
+    :param linesep: The line separator to use.
+    :param encoding: The encoding of the file.
+    """
+    for x in task_list:
+        x._line = crumb_line(x)
+    lines = [(x.linenr if (x.linenr is not None) else len(task_list), x._line)
+             for x in task_list]
+    lines.sort(key=lambda x: x[0])
+    text = "".join(x[1] + linesep for x in lines)
+    tmp = NamedTemporaryFile("wb", buffering=0, dir=path.parent, delete=False,
+                             prefix=".tmp", suffix="~")
+    tmp.write(bytes(text, encoding))
+    fsync(tmp.fileno())
+    tmp.close()
+    replace(tmp.name, path)
+    sync_dir(path.parent)
+
+def append_tasks(path: Path, task_list: List[Task], linesep: str,
+                 encoding: str) -> None:
+    """
+    Appends crumbs to the end of a file, making sure they start on a new line.
+    Each crumb keeps the line it was written as (Task._line).
+
+    :param path: The file to append to.
+    :param task_list: The crumbs to write.
+    :param linesep: The line separator to use.
+    :param encoding: The encoding of the file.
+    """
+    if (not task_list):
+        return
+    for x in task_list:
+        x._line = crumb_line(x)
+    text = linesep.join(x._line for x in task_list) + linesep
+    with open(path, "ab+") as f:
+        if (f.tell()):
+            f.seek(-1, 2)
+            if (f.read(1) not in b"\r\n"):
+                text = linesep + text
+        f.write(bytes(text, encoding))
+        f.flush()
+        fsync(f.fileno())
+
+def crumb_day(task: Task) -> Union[date, None]:
+    """
+    Gets the day a crumb belongs to for the sake of picking its segment.
+
+    :param task: The crumb.
+    :return: The day, None if the crumb has no dates.
+    """
+    ret = task.creation_date or task.completion_date
+    if (isinstance(ret, datetime)):
+        ret = ret.date()
+    return ret
+
+class LoafStore():
+    """
+    Tracks the crumbs of a loaf that have not made it to disk yet. New crumbs
+    are appended to the end of the loaf file, crumbs changed in place need
+    the file (or cold segment) holding them to be rewritten. If the loaf has
+    a journal, it also tracks the changes not yet logged to it.
+    """
+
+    def __init__(self, loaf: TodoTxt, on_disk: bool = True,
+                 segment_dir: Union[Path, None] = None,
+                 split: bool = False, hot_days: int = 40,
+                 journal: Union[Journal, None] = None) -> None:
+        """
+        Starts tracking a loaf.
+
+        :param loaf: The loaf to track.
+        :param on_disk: Does the file on disk already hold the crumbs in the
+        loaf (Eg. it was just parsed)?
+        :param segment_dir: Where the cold segments of the loaf live, if any.
+        :param split: Move old archived crumbs to cold segments on compaction.
+        :param hot_days: How many days of archived crumbs stay in the active
+        segment on compaction.
+        :param journal: The journal of the loaf, if any.
+        """
+        self.loaf = loaf
+        self.journal = journal
+        self.segment_dir = segment_dir
+        self.split = split
+        self.hot_days = hot_days
+        self.segments: Dict[str, Segment] = dict()
+        self.origin: Dict[Task, str] = dict()
+        if ((segment_dir is not None) and segment_dir.is_dir()):
+            for x in sorted(segment_dir.glob("*.loaf")):
+                self.segments[x.stem] = Segment(x.stem, x)
+        self.saved(on_disk)
+
+    def saved(self, on_disk: bool = True) -> None:
+        """
+        Marks every crumb in the loaf as written to disk.
+
+        :param on_disk: If false, the next save will have to rewrite the loaf.
+        """
+        self.tasks_ref = self.loaf.tasks
+        self.saved_count = len(self.loaf.tasks)
+        self.dirty: Set[Task] = set()
+        self.stale_file = not on_disk
+        # Cold segments that had crumbs taken out of them
+        self.emptied: Set[str] = set()
+        self.logged()
+
+    def logged(self) -> None:
+        """
+        Marks every change to the loaf as logged to the journal.
+        """
+        self.logged_count = len(self.loaf.tasks)
+        self.unlogged: Set[Task] = set()
+
+    def mark_dirty(self, task_list: List[Task]) -> None:
+        """
+        Notes crumbs that were changed in place.
+
+        :param task_list: The changed crumbs.
+        """
+        self.dirty.update(task_list)
+        self.unlogged.update(task_list)
+
+    def mark_removed(self, task_list: List[Task]) -> None:
+        """
+        Notes crumbs that were taken out of the loaf.
+
+        :param task_list: The removed crumbs.
+        """
+        for x in task_list:
+            if (x in self.origin):
+                self.emptied.add(self.origin.pop(x))
+            self.dirty.discard(x)
+            self.unlogged.discard(x)
+        self.stale_file = True
+
+    def unlogged_ops(self) -> List[Op]:
+        """
+        Gets the journal operations for the changes since they were last
+        logged, and marks them as logged. Each crumb keeps the line it was
+        logged as (Task._line), which is what later operations refer to it by.
+
+        :return: The operations, in the order they happened.
+        """
+        ret: List[Op] = list()
+        new = [x for x in self.loaf.tasks[self.logged_count:]
+               if (x not in self.origin)]
+        for x in new:
+            x._line = crumb_line(x)
+            ret.append(["add", x._line])
+        new_set = set(new)
+        for x in self.unlogged:
+            if (x in new_set):
+                continue
+            line = crumb_line(x)
+            old = getattr(x, "_line", None)
+            if (line != old):
+                ret.append(["set", old, line])
+                x._line = line
+        self.logged()
+        return ret
+
+    def load_segment(self, seg: Segment) -> None:
+        """
+        Reads the crumbs of a cold segment into the loaf.
+
+        :param seg: The segment to read.
+        """
+        tasks, linesep, stamp, refresh = load_tasks(seg.path, self.loaf.parser,
+                                                    self.loaf.encoding)
+        if (refresh):
+            write_snapshot(seg.path, tasks, stamp, linesep)
+        tasks = [x for x in tasks if (str(x))]
+        for x in tasks:
+            x._line = x._raw
+            x.todotxt = self.loaf
+            self.origin[x] = seg.name
+        self.loaf.tasks.extend(tasks)
+        seg.loaded = True
+
+    def load_for(self, archived: Union[bool, None],
+                 span: Union[Tuple[datetime, datetime], None],
+                 archived_span: Union[Tuple[datetime, datetime], None]) -> None:
+        """
+        Reads in the cold segments a search could reach. Cold segments only
+        hold archived crumbs.
+
+        :param archived: Is the crumb archived, None for both.
+        :param span: Inclusive make datetime bounds.
+        :param archived_span: Inclusive archive datetime bounds.
+        """
+        if (archived is False):
+            return
+        for seg in self.segments.values():
+            if ((not seg.loaded) and seg.reaches(span)
+                    and seg.reaches(archived_span)):
+                self.load_segment(seg)
+
+    def load_all(self) -> None:
+        """
+        Reads every cold segment into the loaf.
+        """
+        for seg in self.segments.values():
+            if (not seg.loaded):
+                self.load_segment(seg)
+
+    def new_tasks(self) -> List[Task]:
+        """
+        Gets the crumbs added to the loaf since the last save.
+
+        :return: The unsaved crumbs, in loaf order.
+        """
+        return [x for x in self.loaf.tasks[self.saved_count:]
+                if (x not in self.origin)]
+
+    def needs_rewrite(self) -> bool:
+        """
+        Checks if a file has to be rewritten rather than appended to.
+
+        :return: True if lines already on disk changed.
+        """
+        if (self.stale_file or (self.tasks_ref is not self.loaf.tasks)
+                or (len(self.loaf.tasks) < self.saved_count)):
+            return True
+        if (self.dirty):
+            new = set(self.new_tasks())
+            return any((x not in new) for x in self.dirty)
+        return False
+
+    def append_new(self) -> None:
+        """
+        Appends the crumbs added since the last save to the loaf file.
+        """
+        append_tasks(self.loaf.filename, self.new_tasks(), self.loaf.linesep,
+                     self.loaf.encoding)
+        self.saved_count = len(self.loaf.tasks)
+        self.dirty = set()
+
+    def rewrite(self, compact: bool = False) -> None:
+        """
+        Rewrites the loaf file and any cold segment holding changed crumbs.
+        Unarchived crumbs found in cold segments are moved back to the loaf
+        file. On compaction with splitting on, archived crumbs older than the
+        hot window are moved out to their cold segments. Crumbs moving out are
+        appended to their segment before the loaf file drops them, crumbs
+        moving in are in the loaf file before their segment drops them.
+
+        :param compact: Is this an explicit compaction.
+        """
+        linesep = self.loaf.linesep
+        encoding = self.loaf.encoding
+        touched: Set[str] = {self.origin[x] for x in self.dirty
+                             if (x in self.origin)}
+        touched.update(self.emptied)
+        # The loaf may be empty (Eg. every crumb undone)
+        next_nr = max(((x.linenr or 0) for x in self.loaf.tasks),
+                      default=0) + 1
+        for x in self.loaf.tasks:
+            if ((x in self.origin) and (not x.is_completed)):
+                touched.add(self.origin.pop(x))
+                x.linenr = next_nr
+                next_nr += 1
+        dropped: Set[Task] = set()
+        if (compact and self.split and (self.segment_dir is not None)):
+            cutoff = date.today() - timedelta(days=self.hot_days)
+            for x in self.loaf.tasks:
+                day = crumb_day(x)
+                if ((x in self.origin) or (not x.is_completed)
+                        or (day is None) or (day >= cutoff)):
+                    continue
+                name = f"{day.year:04d}-{day.month:02d}"
+                seg = self.segments.get(name, None)
+                if (seg is None):
+                    self.segment_dir.mkdir(parents=True, exist_ok=True)
+                    seg = Segment(name, self.segment_dir / f"{name}.loaf",
+                                  loaded=True)
+                    self.segments[name] = seg
+                seg.pending.append(x)
+                if (seg.loaded):
+                    self.origin[x] = name
+                    touched.add(name)
+                else:
+                    dropped.add(x)
+        for seg in self.segments.values():
+            if (seg.pending):
+                append_tasks(seg.path, seg.pending, linesep, encoding)
+                seg.pending = list()
+        active = [x for x in self.loaf.tasks
+                  if ((x not in self.origin) and (x not in dropped))]
+        write_tasks(self.loaf.filename, active, linesep, encoding)
+        for name in touched:
+            seg = self.segments[name]
+            tmp = [x for x in self.loaf.tasks if (self.origin.get(x) == name)]
+            write_tasks(seg.path, tmp, linesep, encoding)
+        if (dropped):
+            self.loaf.tasks = [x for x in self.loaf.tasks
+                               if (x not in dropped)]
+        self.saved()
@@ -2,18 +2,28 @@
 Module that orchestrates the other modules.
 """
 from argparse import ArgumentParser, Namespace
+from contextlib import redirect_stdout
+from json import loads
+from os import environ, stat, umask
 from pathlib import Path
-from re import Match, search, sub
+from queue import Queue
+from re import Match, Pattern, compile, search, sub
 from signal import SIGINT, signal
+from socket import AF_UNIX, SOCK_STREAM, socket
 from sys import exit
+import sys
+from threading import Thread
 from time import sleep, time
-from typing import Dict, Union, Any, List
+from typing import Callable, Dict, Tuple, Union, Any, List
 
 from pytodotxt import TodoTxt
+from rich.console import Console
 from rich.progress import Progress, TaskID
 
+from breadcrumbs import utils
+from breadcrumbs.client import ASK, DONE, EXITED, EXTERNAL, OUTPUT, REQUEST, recv_frame, send_frame, socket_path
 from breadcrumbs.root_plugin import collect_config
-from breadcrumbs.utils import get_contexts, get_tags, save, get_projects
+from breadcrumbs.utils import FLUSH_LOCK, REGEX_CHARS, compile_macros, expand_macros, flush, get_contexts, get_tags, log_step, save_later, get_projects, load_loaf, take_back
 import readline
 
 # The global config state
@@ -24,6 +34,28 @@ LOAF: Union[None, TodoTxt] = None
 last_rec: Union[List[Union[str, None]], None] = None
 # time stamp of last rec update
 last_rec_time: float = time()
+# The config keys merge_cli_config may change
+CLI_CONFIG_KEYS = ("log", "page_size")
+# Pulls the command name (everything up to the first space) out of an input
+CMD_NAME = compile(r'\?(\S*)')
+# The compiled patterns of the commands, keyed by command name
+cmd_patterns: Dict[str, Pattern] = dict()
+# The commands with regex names, longest first
+regex_cmds: List[str] = list()
+# The id and size of the command dict regex_cmds was built from
+regex_cmds_from: Tuple[int, int] = (0, 0)
+# Bumped every time hooks are handed to the background worker, runs asked for
+# before the latest one are dropped
+bg_generation = 0
+# The hook runs waiting for the background worker, as (generation, hook type,
+# hook functions)
+bg_jobs: "Queue[Tuple[int, str, List[Callable]]]" = Queue()
+# The background worker, started when first needed
+bg_worker: Union[None, Thread] = None
+# Is parse running a command (so the loaf may be half changed)
+in_command = False
+# Is the REPL waiting at the prompt
+at_prompt = False
 # The readline conf to use if one is not found
 default_readline = """
 set editing-mode vi
@@ -55,11 +87,12 @@ def complete(text, state) -> Union[None, str]:
     global last_rec, last_rec_time
     if (((last_rec_time + 30) < time()) or (last_rec is None)):
         last_rec_time = time()
-        last_rec = list(get_tags(LOAF).keys())
-        tmp = [f"{x}" for x in get_projects(LOAF)]
-        last_rec.extend(tmp)
-        tmp = [f"{x}" for x in get_contexts(LOAF)]
-        last_rec.extend(tmp)
+        with FLUSH_LOCK:
+            last_rec = list(get_tags(LOAF).keys())
+            tmp = [f"{x}" for x in get_projects(LOAF)]
+            last_rec.extend(tmp)
+            tmp = [f"{x}" for x in get_contexts(LOAF)]
+            last_rec.extend(tmp)
     ret = [x for x in last_rec if (x.startswith(text))]
     if (not ret):
         return None
@@ -69,7 +102,9 @@ def complete(text, state) -> Union[None, str]:
 
 def call_hooks(hook: str) -> None:
     """
-    Calls all hooks registered with a given name.
+    Calls all hooks registered with a given name. While running a batch,
+    only hooks marked with utils.batch_safe are called. In the REPL, hooks
+    marked with utils.background_safe are handed to the background worker.
 
     :args hook: The type of the hook to call.
     """
@@ -77,17 +112,106 @@ def call_hooks(hook: str) -> None:
     if (not h):
         return
     CONFIG['log']['debug'](f"Calling internal hook {hook}.")
+    batch = CONFIG["buffers"]["batch"]
+    background = CONFIG["buffers"]["background"]
+    later = list()
     for hook_call in h:
+        if (batch and (not getattr(hook_call, "batch_safe", False))):
+            continue
+        if (background and getattr(hook_call, "background_safe", False)):
+            later.append(hook_call)
+            continue
         CONFIG['log']['debug'](f"Calling {hook_call.__name__}")
         hook_call(CONFIG, LOAF)
+    if (later):
+        call_later(hook, later)
+
+def call_later(hook: str, hook_list: List[Callable]) -> None:
+    """
+    Hands hooks to the background worker, replacing the runs it has not
+    started yet.
+
+    :param hook: The type of the hooks.
+    :param hook_list: The hook functions to run.
+    """
+    global bg_generation, bg_worker
+    bg_generation += 1
+    bg_jobs.put((bg_generation, hook, hook_list))
+    if (bg_worker is None):
+        bg_worker = Thread(target=background_worker, daemon=True)
+        bg_worker.start()
+
+def record_log(log: Dict[str, Any],
+               records: List[Tuple[str, Tuple, Dict]]) -> Dict[str, Any]:
+    """
+    Makes the display profile used by background hooks, which keeps what is
+    displayed to be shown later.
+
+    :param log: The display profile in use.
+    :param records: Where to keep what is displayed, as (profile entry, args,
+    kwargs).
+    :return: The recording profile.
+    """
+    def no_prompt(text: str = "") -> str:
+        raise Exception("Background hooks can not prompt.")
+    def recorder(name: str) -> Callable:
+        def ret(*args, **kwargs) -> None:
+            records.append((name, args, kwargs))
+        return ret
+    ret = {x: recorder(x) for x in log}
+    ret["prompt"] = no_prompt
+    return ret
+
+def background_worker() -> None:
+    """
+    Runs the hooks handed to the background worker, one run at a time, and
+    shows what they displayed once a run is done. Runs replaced by a newer
+    one are dropped, at the latest between two hooks. FLUSH_LOCK is only
+    held to check for that, the hooks take it themselves while they read the
+    loaf (see background_safe).
+    """
+    while True:
+        gen, hook, hook_list = bg_jobs.get()
+        records: List[Tuple[str, Tuple, Dict]] = list()
+        conf = dict(CONFIG)
+        conf['log'] = record_log(CONFIG['log'], records)
+        superseded = False
+        for hook_call in hook_list:
+            with FLUSH_LOCK:
+                if (gen != bg_generation):
+                    superseded = True
+                    break
+            try:
+                hook_call(conf, LOAF)
+            except Exception as e:
+                records.append(("err", (f"{hook_call.__name__} failed in"
+                                        " the background.", e), {}))
+        if (superseded or (not records)):
+            continue
+        with FLUSH_LOCK:
+            log = CONFIG['log']
+            if (at_prompt):
+                # Show it under the line being typed, then draw that again
+                print()
+            for name, args, kwargs in records:
+                log[name](*args, **kwargs)
+            if (at_prompt):
+                log['reprompt']()
 
 def on_exit(signum, stack) -> None:
     """
-    Calls the redigested EXIT hooks on kill signal.
+    Calls the redigested EXIT hooks on kill signal. Pending saves are
+    written out before and after the hooks. A signal in the middle of a
+    command interrupts it instead, parse then takes back what the command
+    did so far and calls this again.
     """
+    if ((signum is not None) and in_command):
+        raise KeyboardInterrupt()
     CONFIG['log']['fatal'](" Mañana")
+    flush()
     call_hooks("SAFEEXIT")
     call_hooks("EXIT")
+    flush()
     exit(0)
 
 def parse_cli_args() -> Namespace:
@@ -108,6 +232,14 @@ def parse_cli_args() -> Namespace:
                     help='Be less fancy when printing...')
     parser.add_argument('-j', "--json", action="store_true",
                     help='Talk json to me...')
+    parser.add_argument("--json-stream", action="store_true",
+                    help='Talk json to me, one record per line...')
+    parser.add_argument("--daemon", action="store_true",
+                    help=('Keep the loaf loaded and serve crumb commands sent'
+                          ' by other bc calls on this breadbox.'))
+    parser.add_argument("--batch", metavar="FILE",
+                    help=('Run the crumb commands in FILE (- for stdin), one'
+                          ' per line, saving once at the end.'))
     parser.add_argument('crumb_command',
                         metavar='[C]',
                         nargs='?',
@@ -129,6 +261,10 @@ def merge_cli_config(conf: Dict[str, Any], cli: Namespace) -> None:
         conf['log'] = conf['display']['simple']
     if (cli.json):
         conf['log'] = conf['display']['json']
+        conf['page_size'] = 0
+    if (cli.json_stream):
+        conf['log'] = conf['display']['json_stream']
+        conf['page_size'] = 0
 
 def init_loaf(p: Progress, t1: TaskID) -> None:
     """
@@ -142,37 +278,109 @@ def init_loaf(p: Progress, t1: TaskID) -> None:
     p.advance(t1, 20)
     p.update(t1, description="Collecting Config.")
     CONFIG = collect_config(p)
+    compile_macros(CONFIG["macros"])
     loaf_path = Path(CONFIG["breadbox"] + "/default.loaf")
     p.advance(t1, 20)
     p.update(t1, description=f"Loading Loaf From {loaf_path}.")
-    loaf = TodoTxt(loaf_path)
-    loaf.parse()
+    reload_loaf()
+
+def reload_loaf() -> None:
+    """
+    (Re)reads the loaf of the breadbox into the global LOAF.
+    """
+    global LOAF
+    loaf_path = Path(CONFIG["breadbox"] + "/default.loaf")
+    loaf = load_loaf(loaf_path, Path(CONFIG["breadbox"] + "/segments"),
+                     CONFIG["loaf_segments"], CONFIG["hot_days"],
+                     warn=CONFIG["log"]["warn"])
     CONFIG["buffers"]["loaf"] = loaf
     LOAF = loaf
 
-def expand_macros(user_input: str) -> str:
+def loaf_stamp() -> Tuple[int, int]:
     """
-    Expands macros in the input text.
+    Gets the modification time and size of the loaf file, to notice when
+    something other than this process changed it.
 
-    :param user_input: The unprocessed user input.
-    :return: The user_input with expanded macros.
+    :return: The mtime in ns and the size of the loaf file.
     """
-    for name, v in CONFIG["macros"].items():
-        if (isinstance(v, tuple)):
-            before, after = v
-            user_input = sub(before, after, user_input)
-        else:
-            user_input = v(user_input)
-    return user_input
+    tmp = stat(Path(CONFIG["breadbox"] + "/default.loaf"))
+    return (tmp.st_mtime_ns, tmp.st_size)
+
+def cmd_pattern(name: str) -> Pattern:
+    """
+    Gets the compiled pattern matching a command and its args.
 
-def parse(user_input: str) -> None:
+    :param name: The name of the command, may be a regex.
+    :return: The compiled pattern.
     """
-    Takes a breadcrumb command and processes it.
+    ret = cmd_patterns.get(name, None)
+    if (ret is None):
+        ret = compile(r'^\?' + name + r'((?:\s.*)|(?:$))')
+        cmd_patterns[name] = ret
+    return ret
+
+def find_cmd(user_input: str) -> Union[None, Tuple[Callable, Match]]:
+    """
+    Finds the command an input calls. Plain command names are looked up
+    directly, so only commands with regex names are tried one by one
+    (longest name first).
+
+    :param user_input: The input post macro expansion.
+    :return: The command and the match of its args, None if no command
+    matches.
+    """
+    global regex_cmds, regex_cmds_from
+    commands = CONFIG["commands"]
+    tmp = CMD_NAME.match(user_input)
+    if (tmp is None):
+        return None
+    name = tmp.group(1)
+    if ((name in commands) and REGEX_CHARS.isdisjoint(name)):
+        args = cmd_pattern(name).match(user_input)
+        if (args):
+            return (commands[name], args)
+    if (regex_cmds_from != (id(commands), len(commands))):
+        regex_cmds = [x for x in commands if (not REGEX_CHARS.isdisjoint(x))]
+        regex_cmds.sort(key=len, reverse=True)
+        regex_cmds_from = (id(commands), len(commands))
+    for x in regex_cmds:
+        args = cmd_pattern(x).match(user_input)
+        if (args):
+            return (commands[x], args)
+    return None
+
+def parse(user_input: str) -> bool:
+    """
+    Takes a breadcrumb command and processes it. What the command changed is
+    logged to the journal as one step, the loaf is saved on the next flush.
 
     :param user_input: The unprocessed user input.
+    :return: Did the command ask for the loaf to be saved.
     """
+    global in_command
     if (not user_input):
-        return
+        return False
+    with FLUSH_LOCK:
+        was_in_command = in_command
+        in_command = True
+        try:
+            return run_command(user_input)
+        except KeyboardInterrupt as e:
+            # Nothing of a command cut short makes it to disk
+            in_command = False
+            take_back(LOAF)
+            on_exit(None, None)
+        finally:
+            in_command = was_in_command
+    return False
+
+def run_command(user_input: str) -> bool:
+    """
+    Processes a breadcrumb command for parse, which holds FLUSH_LOCK.
+
+    :param user_input: The unprocessed user input.
+    :return: Did the command ask for the loaf to be saved.
+    """
     debug = CONFIG['log']['debug']
     err = CONFIG['log']['err']
     buffers = CONFIG['buffers']
@@ -183,18 +391,15 @@ def parse(user_input: str) -> None:
     user_input = buffers["input_raw"]
     debug("STAGE 1 (POST PREMACRO):")
     debug(user_input)
-    user_input = expand_macros(user_input)
+    user_input = expand_macros(CONFIG, user_input)
     buffers["input_post_macro"] = user_input
     debug("STAGE 2 (POST MACRO):")
     debug(user_input)
     args: Union[None, Match] = None
-    for reg, possible_cmd in CONFIG["commands"].items():
-        reg = (r'^\?' + reg + r'((?:\s.*)|(?:$))')
-        args = search(reg, user_input)
-        if (args):
-            buffers["cmd"] = possible_cmd
-            buffers["args"] = args
-            break
+    found = find_cmd(user_input)
+    if (found):
+        buffers["cmd"], args = found
+        buffers["args"] = args
     call_hooks('PRECMD')
     do_save = False
     is_null_cmd = False
@@ -239,8 +444,11 @@ def parse(user_input: str) -> None:
         else:
             call_hooks('OTHEROK')
     call_hooks('POSTCMD')
-    if (do_save):
-        save(LOAF)
+    if (not buffers["batch"]):
+        log_step(LOAF)
+        if (do_save):
+            save_later(LOAF)
+    return bool(do_save)
 
 def check_if_normal(cli: Namespace) -> bool:
     """
@@ -249,7 +457,7 @@ def check_if_normal(cli: Namespace) -> bool:
     :param cli: The parsed cli args.
     :return: bool to check if display of bars should be false.
     """
-    return ((cli.debug or cli.simple or cli.json))
+    return ((cli.debug or cli.simple or cli.json or cli.json_stream))
 
 def run() -> None:
     """
@@ -257,7 +465,10 @@ def run() -> None:
     """
     signal(SIGINT, on_exit)
     args = parse_cli_args()
-    with Progress(disable=check_if_normal(args), expand=True) as p:
+    # Keep stdout to the records alone when streaming them
+    console = (Console(stderr=True) if (args.json_stream) else None)
+    with Progress(disable=check_if_normal(args), expand=True,
+                  console=console) as p:
         t1 =  p.add_task("Baking Loaf.", total=100)
         init_loaf(p, t1)
         p.advance(t1, 20)
@@ -265,26 +476,229 @@ def run() -> None:
         call_hooks("INIT")
         p.advance(t1, 20)
         p.update(t1, description=f"[cyan]Applying CLI Arguments.")
+        # What the CLI arguments change, so the daemon can start each
+        # client from it
+        config_base = {x: CONFIG[x] for x in CLI_CONFIG_KEYS}
         merge_cli_config(CONFIG, args)
         p.advance(t1, 20)
         p.update(t1, description=f"Dusting Off Crumbs.")
-    if (args.crumb_command):
-        tmp_split = args.crumb_command.split("&")
-        for x in tmp_split:
-            parse(x)
-    else:
-        repl()
+    try:
+        if (args.daemon):
+            serve(config_base)
+        elif (args.batch):
+            run_batch(args.batch)
+        elif (args.crumb_command):
+            tmp_split = args.crumb_command.split("&")
+            for x in tmp_split:
+                parse(x)
+        else:
+            repl()
+    finally:
+        # Whatever way this ends, changes made so far make it to disk
+        flush()
     on_exit(None, None)
 
+def batch_log(log: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Makes the display profile used while running a batch. What commands show
+    (crumbs, figures, info...) is dropped, problems still go to the given
+    profile.
+
+    :param log: The display profile in use.
+    :return: The batch profile.
+    """
+    def no_prompt(text: str = "") -> str:
+        raise Exception("Commands can not prompt in batch mode.")
+    ret = {x: (lambda *args: None) for x in log}
+    for x in ("warn", "err", "fatal"):
+        ret[x] = log[x]
+    ret["prompt"] = no_prompt
+    return ret
+
+def run_batch(source: str) -> None:
+    """
+    Runs a file of crumb commands (one per line, lines are not split on &)
+    through parse without showing their output, then saves the loaf once.
+
+    :param source: The file to read, - for stdin.
+    """
+    log = CONFIG['log']
+    if (source == "-"):
+        lines = sys.stdin
+    else:
+        lines = open(source, encoding="utf-8")
+    CONFIG['log'] = batch_log(log)
+    CONFIG["buffers"]["batch"] = True
+    count = 0
+    do_save = False
+    try:
+        for x in lines:
+            x = x.rstrip("\r\n")
+            if (not x.strip()):
+                continue
+            do_save = parse(x) or do_save
+            count += 1
+    finally:
+        CONFIG["buffers"]["batch"] = False
+        CONFIG['log'] = log
+        if (lines is not sys.stdin):
+            lines.close()
+        if (do_save):
+            save_later(LOAF)
+        flush()
+    log['info'](f"Ran {count} commands.")
+
 def repl() -> None:
     """
     Runs a repl to manage the crumbs.
     """
+    global at_prompt
     init_readline()
     CONFIG['log']['clear']()
     call_hooks("MOTD")
-    while True:
-        tmp = CONFIG['log']['prompt']()
-        tmp_split = tmp.split("&")
-        for x in tmp_split:
-            parse(x)
+    CONFIG["buffers"]["background"] = True
+    try:
+        while True:
+            at_prompt = True
+            try:
+                tmp = CONFIG['log']['prompt']()
+            finally:
+                at_prompt = False
+            tmp_split = tmp.split("&")
+            for x in tmp_split:
+                parse(x)
+    finally:
+        CONFIG["buffers"]["background"] = False
+
+class ClientStream():
+    """
+    Stands in for stdin and stdout while the daemon runs a command for a
+    client, so what gets displayed (and asked) happens on the client side.
+    """
+
+    def __init__(self, conn: socket, tty: bool) -> None:
+        """
+        :param conn: The connection to the client.
+        :param tty: Is the client printing to a terminal.
+        """
+        self.conn = conn
+        self.tty = tty
+        self.encoding = "utf-8"
+
+    def write(self, text: str) -> int:
+        """
+        Sends display output to the client.
+        """
+        send_frame(self.conn, OUTPUT, text)
+        return len(text)
+
+    def flush(self) -> None:
+        """
+        Output is sent as it is written, nothing to flush.
+        """
+        ...
+
+    def isatty(self) -> bool:
+        """
+        Lets rich know if the client is printing to a terminal.
+        """
+        return self.tty
+
+    def readline(self, size: int = -1) -> str:
+        """
+        Asks the client for a line of user input.
+        """
+        send_frame(self.conn, ASK)
+        kind, text = recv_frame(self.conn)
+        return text
+
+    def run_external(self, command: str) -> int:
+        """
+        Runs an external command on the client side.
+
+        :param command: The shell command to run.
+        :return: The exit code of the command.
+        """
+        send_frame(self.conn, EXTERNAL, command)
+        kind, text = recv_frame(self.conn)
+        return int(text)
+
+def serve_client(conn: socket, config_base: Dict[str, Any]) -> None:
+    """
+    Runs one request of a thin client, the same way a one shot bc call would.
+
+    :param conn: The connection to the client.
+    :param config_base: The config keys the CLI arguments change (see
+    CLI_CONFIG_KEYS), as they are when the client asks for nothing else.
+    """
+    kind, text = recv_frame(conn)
+    if (kind != REQUEST):
+        return
+    request = loads(text)
+    stream = ClientStream(conn, request["tty"])
+    old_config = {x: CONFIG[x] for x in CLI_CONFIG_KEYS}
+    old_stdin = sys.stdin
+    old_runner = utils.EXTERNAL_RUNNER
+    environ["COLUMNS"] = str(request["width"])
+    CONFIG.update(config_base)
+    merge_cli_config(CONFIG, Namespace(debug=request["debug"],
+                                       simple=request["simple"],
+                                       json=request["json"],
+                                       json_stream=request["json_stream"]))
+    try:
+        sys.stdin = stream
+        utils.EXTERNAL_RUNNER = stream.run_external
+        with redirect_stdout(stream):
+            for x in request["command"].split("&"):
+                parse(x)
+            CONFIG['log']['fatal'](" Mañana")
+    finally:
+        sys.stdin = old_stdin
+        utils.EXTERNAL_RUNNER = old_runner
+        CONFIG.update(old_config)
+    # The client may look at the loaf as soon as it is done
+    flush()
+    send_frame(conn, DONE)
+
+def serve(config_base: Dict[str, Any]) -> None:
+    """
+    Serves crumb commands from thin clients over a unix socket in the
+    breadbox, one client at a time, keeping the config and loaf loaded in
+    between. The loaf is read again if something else changed it on disk.
+
+    :param config_base: The config keys the CLI arguments change (see
+    CLI_CONFIG_KEYS), before any CLI arguments were applied.
+    """
+    path = socket_path(CONFIG["breadbox"])
+    probe = socket(AF_UNIX, SOCK_STREAM)
+    try:
+        probe.connect(str(path))
+    except OSError as e:
+        path.unlink(missing_ok=True)
+    else:
+        probe.close()
+        CONFIG['log']['warn']("A daemon is already serving this breadbox.")
+        return
+    server = socket(AF_UNIX, SOCK_STREAM)
+    old_mask = umask(0o177)
+    try:
+        server.bind(str(path))
+    finally:
+        umask(old_mask)
+    server.listen()
+    CONFIG['log']['info'](f"Serving {CONFIG['breadbox']} on {path}.")
+    stamp = loaf_stamp()
+    try:
+        while (True):
+            conn, _ = server.accept()
+            with conn:
+                try:
+                    if (loaf_stamp() != stamp):
+                        reload_loaf()
+                    serve_client(conn, config_base)
+                except Exception as e:
+                    CONFIG['log']['err']("Lost a client.", e)
+                stamp = loaf_stamp()
+    finally:
+        server.close()
+        path.unlink(missing_ok=True)
@@ -2,18 +2,60 @@
 Module of common utilities for doing stuff.
 """
 
+from collections import OrderedDict
 from datetime import date, datetime, time, timedelta
-from itertools import filterfalse
+from dataclasses import dataclass
 from pathlib import Path
-from re import search, sub
-from typing import Any, Dict, List, Union, Tuple
+from re import Pattern, compile, escape, search, sub
+from subprocess import run
+from threading import RLock, Timer
+from typing import Any, Callable, Dict, List, Union, Tuple
 from copy import deepcopy
 from pytodotxt import Task, TodoTxt
 import time as old_time
 
 from rich.syntax import Syntax
+from rich.text import Text
 
-from breadcrumbs.lexer import TodotxtLexer
+from breadcrumbs.index import IndexListener, LoafIndex, reindex
+from breadcrumbs.journal import Journal, Op, inverse, journal_path
+from breadcrumbs.lexer import CachedLexer, FastTodotxtLexer
+from breadcrumbs.snapshot import load_tasks, write_snapshot
+from breadcrumbs.storage import LoafStore
+
+# The indexes of the loaded loaves, keyed by the id of the loaf
+INDEXES: Dict[int, LoafIndex] = dict()
+# Told about every crumb filed in or taken out of the loaf indexes, so things
+# derived from crumbs can be kept up to date as they change (see IndexListener)
+CHANGE_LISTENERS: List[IndexListener] = list()
+# The save state of the loaded loaves, keyed by the id of the loaf
+STORES: Dict[int, LoafStore] = dict()
+# How long (in seconds) things have to sit unchanged before pending saves are
+# written out
+FLUSH_DELAY = 1.0
+# Held while the loaves or the selection buffer are changed or written out
+FLUSH_LOCK = RLock()
+# Loaves with changes not yet written out, keyed by the id of the loaf
+PENDING_SAVES: Dict[int, TodoTxt] = dict()
+# The config whose selection buffer is not yet written out
+PENDING_BUFFER: Union[Dict[str, Any], None] = None
+# Writes out pending saves once things have been idle for FLUSH_DELAY
+FLUSH_TIMER: Union[Timer, None] = None
+# Is a flush running (so one interrupted by a signal is not re-entered)
+flushing = False
+# The lexer crumbs are highlighted with, shared so the tokens it keeps are
+# reused across calls
+LEXER = CachedLexer(FastTodotxtLexer())
+# The highlighted text of what easy_lex showed last, by text and theme
+HIGHLIGHT_CACHE: "OrderedDict[Tuple[str, str], Text]" = OrderedDict()
+# How many highlighted texts HIGHLIGHT_CACHE keeps
+HIGHLIGHT_CACHE_SIZE = 256
+# Chars that make a name a regex rather than plain text
+REGEX_CHARS = frozenset(".^$*+?{}[]\\|()")
+# Runs an external shell command, returning its exit code. The daemon swaps
+# this out so the command runs on the client side
+EXTERNAL_RUNNER: Callable[[str], int] = (
+    lambda x: run(x, shell=True, encoding='utf-8').returncode)
 
 def span_to_delta(ts: str) -> timedelta:
     """
@@ -40,6 +82,40 @@ def span_to_delta(ts: str) -> timedelta:
     t = timedelta(**tmp)
     return t
 
+def crumb_fields(t: Task) -> Dict[Any, Any]:
+    """
+    Gets the cache of fields worked out from a crumb (make date, archive date,
+    FUTURE date, bare text, ...). The cache lives on the crumb and is thrown
+    out when the text, dates or archive state of the crumb change.
+
+    :param t: The crumb to get the cache of.
+    :return: The cache, keyed by field.
+    """
+    stamp = (t.description, t.creation_date, t.completion_date,
+             t.is_completed)
+    cache = t.__dict__.get("_crumb_fields", None)
+    if ((cache is None) or (cache[0] != stamp)):
+        cache = (stamp, dict())
+        t._crumb_fields = cache
+    return cache[1]
+
+def cached_field(t: Task, key: Any, make: Callable[[], Any]) -> Any:
+    """
+    Gets a field of a crumb from its cache, working it out if needed.
+
+    :param t: The crumb the field is from.
+    :param key: The name of the field in the cache.
+    :param make: Works out the field when it is not cached.
+    :return: The field.
+    """
+    fields = crumb_fields(t)
+    try:
+        ret = fields[key]
+    except KeyError:
+        ret = make()
+        fields[key] = ret
+    return ret
+
 def task_to_make_date(t: Task, d_tag: Union[None, str] = None,
                       t_tag: str = "TIME") -> datetime:
     """
@@ -50,6 +126,14 @@ def task_to_make_date(t: Task, d_tag: Union[None, str] = None,
     :param t_tag: The tag of the time component.
     :retrun: a new datetime object.
     """
+    return cached_field(t, ("make", d_tag, t_tag),
+                        lambda: parse_make_date(t, d_tag, t_tag))
+
+def parse_make_date(t: Task, d_tag: Union[None, str] = None,
+                    t_tag: str = "TIME") -> datetime:
+    """
+    Works out the make date of a crumb, see task_to_make_date.
+    """
     T = t.attributes.get(t_tag, [None])[0]
     if (T is None):
         T = "01-01"
@@ -75,6 +159,14 @@ def task_to_archive_date(t: Task, d_tag: Union[None, str] = None,
     :param t_tag: The tag of the time component.
     :retrun: a new datetime object.
     """
+    return cached_field(t, ("archive", d_tag, t_tag),
+                        lambda: parse_archive_date(t, d_tag, t_tag))
+
+def parse_archive_date(t: Task, d_tag: Union[None, str] = None,
+                       t_tag: str = "ATIME") -> datetime:
+    """
+    Works out the archive date of a crumb, see task_to_archive_date.
+    """
     T = t.attributes.get(t_tag, [None])[0]
     if (T is None):
         T = "01-01"
@@ -91,33 +183,78 @@ def task_to_archive_date(t: Task, d_tag: Union[None, str] = None,
     ret = datetime.combine(D, time(hour=int(h), minute=int(m)))
     return ret
 
-def parse_span(span: str) -> Tuple[datetime, datetime]:
+def task_to_day(t: Task, key: str) -> Tuple[int, int, int]:
+    """
+    Gets the (year, month, day) of a date tag of a crumb.
+
+    :param t: the task to process.
+    :param key: The tag holding the date.
+    :return: The day as a tuple.
+    """
+    def make() -> Tuple[int, int, int]:
+        date_txt = t.attributes.get(key, ["1970-01-01"])[0]
+        tmp = tuple(date_txt.split("-"))
+        return (int(tmp[0]), int(tmp[1]), int(tmp[2]))
+    return cached_field(t, ("day", key), make)
+
+def task_to_bare(t: Task) -> str:
+    """
+    Gets the description of a crumb without contexts, projects or tags.
+
+    :param t: the task to process.
+    :return: The bare description.
+    """
+    return cached_field(t, "bare", t.bare_description)
+
+def task_to_projects(t: Task) -> List[str]:
+    """
+    Gets the +projects of a crumb.
+
+    :param t: the task to process.
+    :return: The projects, in order.
+    """
+    return cached_field(t, "projects", lambda: t.projects)
+
+def task_to_contexts(t: Task) -> List[str]:
+    """
+    Gets the @contexts of a crumb.
+
+    :param t: the task to process.
+    :return: The contexts, in order.
+    """
+    return cached_field(t, "contexts", lambda: t.contexts)
+
+def parse_span(span: str,
+               now: Union[datetime, None] = None) -> Tuple[datetime, datetime]:
     """
     Takes a span of date specification.
 
     :param dr: A sting of A string of the format TIMEDATE-TIMEDATE where TIMEDATE
     can be ~ to indicate an open interval, or an int followed by m,h,d,w,y to
     specify minutes, hours, days, weeks, and years.
+    :param now: The moment the span is relative to. Defaults to now.
     :return: A tuple of the start date and end date of the span.
     """
+    if (now is None):
+        now = datetime.now()
     before, after = span.split("-")
     if (before == "~"):
         before_t = datetime(1970, 1, 1)
     else:
         try:
             before_d = span_to_delta(before)
-            before_t = datetime.now() - before_d
+            before_t = now - before_d
             if (not (("h" in before) or ("m" in before))):
                 before_t = datetime(before_t.year, before_t.month,
                                     before_t.day, hour=0, minute=0)
         except Exception as E:
             raise Exception("Invalid range.")
     if (after == "~"):
-        after_t = datetime.now()
+        after_t = now
     else:
         try:
             after_d = span_to_delta(after)
-            after_t = datetime.now() - after_d
+            after_t = now - after_d
         except Exception as E:
             raise Exception("Invalid range.")
     return (before_t, after_t)
@@ -131,19 +268,206 @@ def order_by_date(task_list: List[Task],
     :param key: An optional key, that when provided will be used as the source
     of the date. Otherwise the date used is the creation_date.
     """
-    def sort_method(x: Task) -> Union[Tuple[int, int, int], Tuple[int, int, int, int, int]]:
+    def sort_method(x: Task) -> Union[datetime, Tuple[int, int, int]]:
         if (key is None):
-            date_txt = task_to_make_date(x).timetuple()
-            tmp = tuple(date_txt)
-            return tmp
+            return task_to_make_date(x)
         else:
-            date_txt = x.attributes.get(key, ["1970-01-01"])[0]
-            tmp = tuple(date_txt.split("-"))
-            tmp_2 = (int(tmp[0]), int(tmp[1]), int(tmp[2]))
-            return tmp_2
+            return task_to_day(x, key)
     task_list.sort(key=sort_method)
 
 
+def get_index(loaf: TodoTxt) -> LoafIndex:
+    """
+    Gets the index of a loaf, building it on first use and catching it up with
+    any crumbs added since.
+
+    :param loaf: The loaf to get the index of.
+    :return: The up to date index.
+    """
+    idx = INDEXES.get(id(loaf), None)
+    if ((idx is None) or (idx.loaf is not loaf)):
+        idx = LoafIndex(loaf, task_to_make_date, task_to_archive_date,
+                        task_to_projects, task_to_contexts,
+                        CHANGE_LISTENERS)
+        INDEXES[id(loaf)] = idx
+    else:
+        idx.sync()
+    return idx
+
+def get_store(loaf: TodoTxt) -> LoafStore:
+    """
+    Gets the save state of a loaf. A loaf that was never tracked will be
+    rewritten in full on its next save.
+
+    :param loaf: The loaf to get the save state of.
+    :return: The save state.
+    """
+    store = STORES.get(id(loaf), None)
+    if ((store is None) or (store.loaf is not loaf)):
+        store = LoafStore(loaf, on_disk=False)
+        STORES[id(loaf)] = store
+    return store
+
+def track_loaf(loaf: TodoTxt, segment_dir: Union[Path, None] = None,
+               split: bool = False, hot_days: int = 40,
+               journal: Union[Journal, None] = None) -> None:
+    """
+    Starts tracking a freshly parsed loaf, whose crumbs are all on disk.
+
+    :param loaf: The parsed loaf.
+    :param segment_dir: Where the cold segments of the loaf live, if any.
+    :param split: Move old archived crumbs to cold segments on compaction.
+    :param hot_days: How many days of archived crumbs to keep in the loaf
+    file itself.
+    :param journal: The journal to log the changes to the loaf to, if any.
+    """
+    STORES[id(loaf)] = LoafStore(loaf, on_disk=True, segment_dir=segment_dir,
+                                 split=split, hot_days=hot_days,
+                                 journal=journal)
+
+def load_loaf(path: Path, segment_dir: Union[Path, None] = None,
+              split: bool = False, hot_days: int = 40,
+              warn: Union[Callable[[str], None], None] = None,
+              replay: bool = True) -> TodoTxt:
+    """
+    Reads a loaf from disk and starts tracking it. The loaf is read from its
+    snapshot while the snapshot still matches the file, the snapshot is
+    taken again (with the index fields worked out) once it falls behind.
+    Steps in the journal of the loaf that did not make it to the file (Eg.
+    on a crash) are played again and saved. If that fails, the loaf is read
+    again as it is on disk and the journal is left as it is.
+
+    :param path: The loaf file.
+    :param segment_dir: Where the cold segments of the loaf live, if any.
+    :param split: Move old archived crumbs to cold segments on compaction.
+    :param hot_days: How many days of archived crumbs to keep in the loaf
+    file itself.
+    :param warn: Called with a warning if the journal could not be played.
+    :param replay: Play the steps missing from the file again.
+    :return: The loaded loaf.
+    """
+    loaf = TodoTxt(path)
+    task_list, linesep, stamp, refresh = load_tasks(path, loaf.parser,
+                                                    loaf.encoding)
+    for x in task_list:
+        # The line of the crumb on disk (Task._raw is lost once a crumb
+        # is changed), see LoafStore.unlogged_ops
+        x._line = x._raw
+        x.todotxt = loaf
+    loaf.tasks = task_list
+    loaf.linesep = linesep
+    journal = Journal(journal_path(path))
+    track_loaf(loaf, segment_dir, split, hot_days, journal)
+    if (refresh):
+        get_index(loaf)
+        write_snapshot(path, task_list, stamp, linesep)
+    if (replay and journal.tail):
+        # If the file is not the one last checkpointed, some of the steps may
+        # already be in it
+        careful = not journal.matches(stamp.mtime, stamp.size)
+        try:
+            apply_ops(loaf, journal.tail, careful)
+            save(loaf)
+        except Exception as e:
+            if (warn is not None):
+                warn(f"Could not play the journal of {path} again"
+                     f" ({type(e).__name__}: {e}), it is kept as is.")
+            # Drop the half played loaf
+            INDEXES.pop(id(loaf), None)
+            STORES.pop(id(loaf), None)
+            PENDING_SAVES.pop(id(loaf), None)
+            return load_loaf(path, segment_dir, split, hot_days,
+                             replay=False)
+    return loaf
+
+def mark_changed(task_list: List[Task]) -> None:
+    """
+    Lets the loaf bookkeeping know that crumbs were changed in place.
+
+    :param task_list: The changed crumbs.
+    """
+    reindex(INDEXES.values(), task_list)
+    for store in STORES.values():
+        store.mark_dirty(task_list)
+
+@dataclass
+class SearchPlan():
+    """
+    A loaf search with its arguments worked out once (span bounds, compiled
+    regex, priority), so every crumb is judged against the same moment in
+    time.
+    """
+    # The compiled regex to search the text with
+    regex: Union[Pattern, None] = None
+    # Search the full text of the crumb rather than the description
+    raw_text: bool = False
+    # Is the crumb archived
+    archived: Union[bool, None] = None
+    # Upper case priority char, "" for no priority
+    priority: Union[str, None] = None
+    # Inclusive make datetime bounds
+    span: Union[Tuple[datetime, datetime], None] = None
+    # Inclusive archive datetime bounds
+    archived_span: Union[Tuple[datetime, datetime], None] = None
+
+    def text_matches(self, x: Task) -> bool:
+        """
+        Checks a crumb against the regex of the plan.
+
+        :param x: The crumb to check.
+        :return: True if the crumb should be kept.
+        """
+        if (self.regex is None):
+            return True
+        if (self.raw_text):
+            tex = str(x)
+        else:
+            tex = x.description
+        if (tex is None):
+            return False
+        return (self.regex.search(tex) is not None)
+
+def plan_search(regex_str: Union[str,None] = None,
+                raw_text: bool = False,
+                archived: Union[bool, None] = None,
+                priority: Union[str, None] = None,
+                span: Union[str, None] = None,
+                archived_span: Union[str, None] = None) -> SearchPlan:
+    """
+    Turns the arguments of a loaf search into a SearchPlan. Takes the same
+    arguments as loaf_search.
+
+    :return: The planned search.
+    """
+    now = datetime.now()
+    plan = SearchPlan(raw_text=raw_text, archived=archived)
+    if (regex_str is not None):
+        plan.regex = compile(regex_str)
+    if (priority is not None):
+        plan.priority = priority.upper()
+    if (span is not None):
+        plan.span = parse_span(span, now)
+    if (archived_span is not None):
+        plan.archived_span = parse_span(archived_span, now)
+    return plan
+
+def run_search(loaf: TodoTxt, plan: SearchPlan) -> List[Task]:
+    """
+    Runs a planned search against a loaf.
+
+    :param loaf: The loaf to search through.
+    :param plan: The planned search.
+    :return: A list of matching tasks.
+    """
+    get_store(loaf).load_for(plan.archived, plan.span, plan.archived_span)
+    res = get_index(loaf).query(archived=plan.archived,
+                                priority=plan.priority,
+                                span=plan.span,
+                                archived_span=plan.archived_span)
+    if (plan.regex is not None):
+        res = [x for x in res if (plan.text_matches(x))]
+    return res
+
 def loaf_search(loaf: TodoTxt,
                 regex_str: Union[str,None] = None,
                 raw_text: bool = False,
@@ -171,69 +495,10 @@ def loaf_search(loaf: TodoTxt,
     NOTE The m and h marks are meaningless for this field.
     :return: A list of matching tasks.
     """
-    def filter_regex(x: Task) -> bool:
-        # TODO could use a speedup with caching here
-        nonlocal regex_str, raw_text
-        if (raw_text):
-            tex = str(x)
-        else:
-            tex = x.description
-        if (tex is None):
-            return True
-        reg = search(regex_str, tex)
-        if (reg is None):
-            return True
-        else:
-            return False
-
-    def filter_archive(x: Task) -> bool:
-        nonlocal archived
-        ret = not (archived == x.is_completed)
-        return ret
-
-    def filter_priority(x: Task) -> bool:
-        nonlocal priority
-        if (priority == ""):
-            priority = None
-        else:
-            priority = priority.upper()
-        ret = not (priority == x.priority)
-        return ret
-
-    def filter_span(x: Task) -> bool:
-        nonlocal span
-        before_t, after_t = parse_span(span)
-        task_time = task_to_make_date(x)
-        now = datetime.now()
-        if ((before_t <= task_time) and (task_time <= after_t)):
-            ret = False
-        else:
-            ret = True
-        return ret
-
-    def filter_archive_span(x: Task) -> bool:
-        nonlocal archived_span
-        before_t, after_t = parse_span(archived_span)
-        task_time = task_to_archive_date(x)
-        now = datetime.now()
-        if ((before_t <= task_time) and (task_time <= after_t)):
-            ret = False
-        else:
-            ret = True
-        return ret
-
-    res = list(loaf.tasks)
-    if (archived is not None):
-        res = list(filterfalse(filter_archive, res))
-    if (priority is not None):
-        res = list(filterfalse(filter_priority, res))
-    if (span is not None):
-        res = list(filterfalse(filter_span, res))
-    if (archived_span is not None):
-        res = list(filterfalse(filter_archive_span, res))
-    if (regex_str is not None):
-        res = list(filterfalse(filter_regex, res))
-    return res
+    plan = plan_search(regex_str=regex_str, raw_text=raw_text,
+                       archived=archived, priority=priority, span=span,
+                       archived_span=archived_span)
+    return run_search(loaf, plan)
 
 def get_projects(loaf: TodoTxt) -> Dict[str, int]:
     """
@@ -242,14 +507,8 @@ def get_projects(loaf: TodoTxt) -> Dict[str, int]:
     :param loaf: The loaf to extract from.
     :return: A dict keyed by project and values are how many references.
     """
-    res = loaf_search(loaf, archived=False, regex_str=r"\+\S*\s*")
-    tmp = list()
-    for x in res:
-        if (x.projects is not None):
-            tmp.extend(x.projects)
-    ret = dict()
-    for x in tmp:
-        ret[x] = (ret.get(x, 0) + 1)
+    idx = get_index(loaf)
+    ret = idx.count_terms(idx.projects, "projects")
     return ret
 
 def get_contexts(loaf: TodoTxt) -> Dict[str, int]:
@@ -259,14 +518,8 @@ def get_contexts(loaf: TodoTxt) -> Dict[str, int]:
     :param loaf: The loaf to extract from.
     :return: A dict keyed by context and values are how many references.
     """
-    res = loaf_search(loaf, archived=False, regex_str=r"@\S*\s*")
-    tmp = list()
-    for x in res:
-        if (x.contexts is not None):
-            tmp.extend(x.contexts)
-    ret = dict()
-    for x in tmp:
-        ret[x] = (ret.get(x, 0) + 1)
+    idx = get_index(loaf)
+    ret = idx.count_terms(idx.contexts, "contexts")
     return ret
 
 def get_tags(loaf: TodoTxt) -> Dict[str, int]:
@@ -276,14 +529,8 @@ def get_tags(loaf: TodoTxt) -> Dict[str, int]:
     :param loaf: The loaf to extract from.
     :return: A dict keyed by tag and values are how many references.
     """
-    res = loaf_search(loaf, archived=False, regex_str=r"\s\S*:\S*\s*")
-    tmp = list()
-    for x in res:
-        if (x.attributes is not None):
-            tmp.extend(x.attributes.keys())
-    ret = dict()
-    for x in tmp:
-        ret[x] = (ret.get(x, 0) + 1)
+    idx = get_index(loaf)
+    ret = idx.count_terms(idx.tags, "tags")
     return ret
 
 def archive(task_list: List[Task]) -> None:
@@ -299,6 +546,7 @@ def archive(task_list: List[Task]) -> None:
         dt = dt.replace(":", "-")
         task.add_attribute("ATIME", dt)
         task.is_completed = True
+    mark_changed(task_list)
 
 def unarchive(task_list: List[Task]) -> None:
     """
@@ -311,6 +559,7 @@ def unarchive(task_list: List[Task]) -> None:
             continue
         task.remove_attribute("ATIME")
         task.is_completed = False
+    mark_changed(task_list)
 
 def add_task(loaf: TodoTxt, task: str) -> Task:
     """
@@ -331,25 +580,385 @@ def add_task(loaf: TodoTxt, task: str) -> Task:
     if (tmp.creation_date is None):
         tmp.creation_date = datetime.now()
     loaf.add(tmp)
+    get_index(loaf).add(tmp)
     return tmp
 
-def save(loaf: TodoTxt) -> None:
+def save(loaf: TodoTxt, compact: bool = False) -> None:
     """
-    Saves the loaf in an undooable way.
+    Saves the loaf in an undooable way. New crumbs are appended to the loaf
+    file, the file is only sorted and rewritten in full when crumbs already on
+    disk changed or when asked to compact. Compacting also moves old archived
+    crumbs out to cold segments when the loaf is split. The save is marked
+    as a checkpoint in the journal of the loaf. Nothing is written if nothing
+    changed since the last checkpoint.
 
     :param loaf: the loaf to save.
+    :param compact: Force a full sorted rewrite.
     """
-    order_by_date(loaf.tasks)
-    loaf.save(safe=True)
+    log_step(loaf)
+    store = get_store(loaf)
+    if ((not compact) and (not store.needs_rewrite())
+            and (not store.new_tasks())
+            and ((store.journal is None) or (not store.journal.tail))):
+        return
+    if (compact or store.needs_rewrite()):
+        order_by_date(loaf.tasks)
+        store.rewrite(compact)
+        get_index(loaf).renumber()
+    else:
+        store.append_new()
+    if (store.journal is not None):
+        tmp = loaf.filename.stat()
+        store.journal.mark_checkpoint(tmp.st_mtime_ns, tmp.st_size)
 
-def undo(loaf: TodoTxt) -> None:
+def save_later(loaf: TodoTxt) -> None:
     """
-    Undo the last save action.
+    Marks a loaf as changed, so it is saved once things have been idle for
+    FLUSH_DELAY (or on flush). Many changes in a row only cost one save.
 
     :param loaf: the loaf to save.
     """
-    # TODO a more comprehensive undo / backup
-    ...
+    with FLUSH_LOCK:
+        PENDING_SAVES[id(loaf)] = loaf
+        schedule_flush()
+
+def schedule_flush() -> None:
+    """
+    (Re)starts the idle timer that writes out pending saves.
+    """
+    global FLUSH_TIMER
+    with FLUSH_LOCK:
+        if (FLUSH_TIMER is not None):
+            FLUSH_TIMER.cancel()
+        FLUSH_TIMER = Timer(FLUSH_DELAY, flush)
+        FLUSH_TIMER.daemon = True
+        FLUSH_TIMER.start()
+
+def flush() -> None:
+    """
+    Writes out every pending save and the selection buffer now. A loaf stays
+    pending if saving it fails.
+    """
+    global FLUSH_TIMER, PENDING_BUFFER, flushing
+    with FLUSH_LOCK:
+        if (flushing):
+            return
+        flushing = True
+        try:
+            if (FLUSH_TIMER is not None):
+                FLUSH_TIMER.cancel()
+                FLUSH_TIMER = None
+            for k, loaf in list(PENDING_SAVES.items()):
+                save(loaf)
+                del PENDING_SAVES[k]
+            if (PENDING_BUFFER is not None):
+                write_buffer(PENDING_BUFFER)
+                PENDING_BUFFER = None
+        finally:
+            flushing = False
+
+def log_step(loaf: TodoTxt) -> None:
+    """
+    Logs the changes made to a loaf since the last step to its journal, as
+    one step. Does nothing for loaves without a journal.
+
+    :param loaf: The changed loaf.
+    """
+    store = get_store(loaf)
+    if (store.journal is None):
+        return
+    with FLUSH_LOCK:
+        ops = store.unlogged_ops()
+        if (ops):
+            store.journal.log(ops)
+
+def set_line(task: Task, line: str) -> None:
+    """
+    Changes a crumb in place to match a line of a loaf file.
+
+    :param task: The crumb to change.
+    :param line: The line.
+    """
+    task.description = None
+    task.priority = None
+    task.completion_date = None
+    task.creation_date = None
+    task.parse(line)
+    task._line = line
+
+def apply_ops(loaf: TodoTxt, ops: List[Op], careful: bool = False) -> int:
+    """
+    Applies journal operations to a loaf. Operations on crumb lines that are
+    not in the loaf (Eg. changed on disk since) are skipped. The changes are
+    not logged to the journal again.
+
+    :param loaf: The loaf to change.
+    :param ops: The operations.
+    :param careful: For when the operations may already have been applied.
+    Each crumb already in the loaf stands in for one add of its line, the last
+    ones in the loaf first, instead of adding the line again.
+    :return: How many of the operations were applied.
+    """
+    store = get_store(loaf)
+    idx = get_index(loaf)
+    changed = list()
+    removed = list()
+    def lines() -> Dict[str, List[Task]]:
+        gone = set(removed)
+        ret: Dict[str, List[Task]] = dict()
+        for x in loaf.tasks:
+            line = getattr(x, "_line", None)
+            if ((line is not None) and (x not in gone)):
+                ret.setdefault(line, list()).append(x)
+        return ret
+    by_line = lines()
+    # The crumbs already in the loaf that no add was matched with yet
+    unmatched = {k: list(v) for k, v in by_line.items()}
+    count = 0
+    for x in ops:
+        if (x[0] == "add"):
+            if (careful and unmatched.get(x[1], None)):
+                unmatched[x[1]].pop()
+                continue
+            tmp = Task(x[1])
+            tmp._line = x[1]
+            loaf.add(tmp)
+            idx.add(tmp)
+            by_line.setdefault(x[1], list()).append(tmp)
+        else:
+            found = by_line.get(x[1], None)
+            if ((not found)
+                    and any((not y.loaded) for y in store.segments.values())):
+                # The crumb may be in a cold segment
+                store.load_all()
+                by_line = lines()
+                found = by_line.get(x[1], None)
+            if (not found):
+                continue
+            tmp = found.pop()
+            if (x[0] == "del"):
+                removed.append(tmp)
+            else:
+                set_line(tmp, x[2])
+                by_line.setdefault(x[2], list()).append(tmp)
+                changed.append(tmp)
+        count += 1
+    if (removed):
+        gone = set(removed)
+        for x in removed:
+            idx.remove(x)
+        changed = [x for x in changed if (x not in gone)]
+        loaf.tasks[:] = [x for x in loaf.tasks if (x not in gone)]
+        store.mark_removed(removed)
+    mark_changed(changed)
+    store.logged()
+    return count
+
+def take_back(loaf: TodoTxt) -> None:
+    """
+    Takes back the changes made to a loaf since the last step was logged
+    (Eg. by a command cut short), without logging anything.
+
+    :param loaf: The loaf to change.
+    """
+    store = get_store(loaf)
+    with FLUSH_LOCK:
+        apply_ops(loaf, inverse(store.unlogged_ops()))
+
+def undo(loaf: TodoTxt) -> bool:
+    """
+    Takes back the last step logged to the journal of a loaf.
+
+    :param loaf: The loaf to change.
+    :return: False if there was nothing to undo.
+    """
+    store = get_store(loaf)
+    if (store.journal is None):
+        return False
+    with FLUSH_LOCK:
+        log_step(loaf)
+        if (not store.journal.undo_steps):
+            return False
+        seq, ops = store.journal.undo_steps[-1]
+        tmp = inverse(ops)
+        apply_ops(loaf, tmp)
+        store.journal.log(tmp, undo=seq)
+    return True
+
+def redo(loaf: TodoTxt) -> bool:
+    """
+    Does the last undone step of a loaf again.
+
+    :param loaf: The loaf to change.
+    :return: False if there was nothing to redo.
+    """
+    store = get_store(loaf)
+    if (store.journal is None):
+        return False
+    with FLUSH_LOCK:
+        log_step(loaf)
+        if (not store.journal.redo_steps):
+            return False
+        seq, ops = store.journal.redo_steps[-1]
+        apply_ops(loaf, ops)
+        store.journal.log(ops, redo=seq)
+    return True
+
+@dataclass
+class MacroStep():
+    """
+    A macro compiled into the macro pipeline.
+    """
+    # The text every expansion of the macro starts with, None if not known
+    trigger: Union[str, None]
+    # The compiled before regex of a (before, after) macro
+    before: Union[Pattern, None] = None
+    # The after regex of a (before, after) macro
+    after: str = ""
+    # The function of a callable macro
+    func: Union[Callable[[str], str], None] = None
+
+    def expand(self, text: str) -> str:
+        """
+        Runs the macro over some text, if its trigger is in the text.
+
+        :param text: The text to expand.
+        :return: The expanded text.
+        """
+        if ((self.trigger is not None) and (self.trigger not in text)):
+            return text
+        if (self.func is not None):
+            return self.func(text)
+        return self.before.sub(self.after, text)
+
+# The compiled macro pipeline, in macro order
+MACRO_STEPS: List[MacroStep] = list()
+# Matches any macro trigger, None if some macro has no known trigger
+MACRO_FILTER: Union[Pattern, None] = None
+# The id and size of the macro dict the pipeline was compiled from
+MACROS_FROM: Tuple[int, int] = (0, 0)
+
+def literal_prefix(regex: str) -> Union[str, None]:
+    """
+    Works out the plain text every match of a regex starts with.
+
+    :param regex: The regex.
+    :return: The plain text, None if there is none (or it can not be told).
+    """
+    if ("|" in regex):
+        return None
+    ret = list()
+    i = 0
+    while (i < len(regex)):
+        c = regex[i]
+        if (c == "\\"):
+            if ((i + 1 >= len(regex)) or regex[i + 1].isalnum()):
+                break
+            char = regex[i + 1]
+            step = 2
+        elif (c in REGEX_CHARS):
+            break
+        else:
+            char = c
+            step = 1
+        if (regex[i + step:i + step + 1] in ("*", "?", "{")):
+            break
+        ret.append(char)
+        i += step
+    return ("".join(ret) or None)
+
+def compile_macros(macros: Dict[str, Any]) -> None:
+    """
+    Compiles the macros into the macro pipeline. A (before, after) macro is
+    triggered by the plain start of its before regex. A callable macro runs on
+    all text, unless it was given a trigger with macro_trigger.
+
+    :param macros: The macros of the config.
+    """
+    global MACRO_STEPS, MACRO_FILTER, MACROS_FROM
+    steps = list()
+    for k, v in macros.items():
+        if (isinstance(v, tuple)):
+            before, after = v
+            steps.append(MacroStep(literal_prefix(before), before=compile(before),
+                                   after=after))
+        else:
+            steps.append(MacroStep(getattr(v, "trigger", None), func=v))
+    triggers = [x.trigger for x in steps]
+    if (None in triggers):
+        MACRO_FILTER = None
+    else:
+        MACRO_FILTER = compile("|".join(escape(x) for x in triggers)
+                               or r"(?!)")
+    MACRO_STEPS = steps
+    MACROS_FROM = (id(macros), len(macros))
+
+def expand_macros(conf: Dict[str, Any], text: str) -> str:
+    """
+    Expands macros in some text, in macro order. Text with no macro trigger
+    in it is returned as is.
+
+    :param conf: The final config.
+    :param text: The text to expand.
+    :return: The text with expanded macros.
+    """
+    macros = conf["macros"]
+    if (MACROS_FROM != (id(macros), len(macros))):
+        compile_macros(macros)
+    if ((MACRO_FILTER is not None) and (not MACRO_FILTER.search(text))):
+        return text
+    for x in MACRO_STEPS:
+        text = x.expand(text)
+    return text
+
+def macro_trigger(trigger: str) -> Callable[[Callable], Callable]:
+    """
+    Gives a callable macro a trigger, the plain text every text it changes has
+    in it. The macro is then skipped for text without the trigger. Callable
+    macros without a trigger run on all text.
+
+    :param trigger: The trigger of the macro.
+    :return: A decorator setting the trigger on the macro.
+    """
+    def mark(macro: Callable) -> Callable:
+        macro.trigger = trigger
+        return macro
+    return mark
+
+def batch_safe(hook: Callable) -> Callable:
+    """
+    Marks a hook as safe to call for every command of a batch (bc --batch).
+    Hooks that are not marked are skipped while a batch runs.
+
+    :param hook: The hook function.
+    :return: The same hook.
+    """
+    hook.batch_safe = True
+    return hook
+
+def background_safe(hook: Callable) -> Callable:
+    """
+    Marks a hook as safe to run on the background worker of the REPL, after
+    the command returned. What it displays is shown once it is done. Runs
+    asked for by a newer command replace the ones not started yet. The hook
+    is called without FLUSH_LOCK, it has to hold FLUSH_LOCK itself while it
+    reads or changes the loaf (and only then, so commands are not held up).
+
+    :param hook: The hook function.
+    :return: The same hook.
+    """
+    hook.background_safe = True
+    return hook
+
+def run_external(command: str) -> None:
+    """
+    Runs an external shell command (Eg. an editor) where the user is.
+
+    :param command: The shell command to run.
+    """
+    ret = EXTERNAL_RUNNER(command)
+    if (ret):
+        raise Exception(f"'{command}' exited with {ret}.")
 
 def get_buffer(conf: Dict[str, Any]) -> List[Task]:
     """
@@ -377,25 +986,120 @@ def drop_buffer(conf: Dict[str, Any]) -> None:
 
 def set_buffer(conf: Dict[str, Any], data: List[Task]) -> None:
     """
-    Sets the active buffer, resets the timeout.
+    Sets the active buffer, resets the timeout. The buffer is written to disk
+    with the next flush, while a batch runs that is once the batch is done.
 
     :param conf: The configuration where the buffer is located.
     :param data: The value to set the buffer to.
     """
-    conf["buffers"]["selection_buffer"] = data
-    conf["buffers"]["selection_buffer_exp"] = (old_time.time() + 30)
+    global PENDING_BUFFER
+    with FLUSH_LOCK:
+        conf["buffers"]["selection_buffer"] = data
+        conf["buffers"]["selection_buffer_exp"] = (old_time.time() + 30)
+        PENDING_BUFFER = conf
+        if (not conf["buffers"]["batch"]):
+            schedule_flush()
+
+def page_bounds(conf: Dict[str, Any], total: int,
+                page: int) -> Tuple[int, int, int, int]:
+    """
+    Works out which part of a selection a page holds. A page_size of 0 makes
+    the whole selection one page.
+
+    :param conf: The configuration holding the page size.
+    :param total: How many crumbs are in the selection.
+    :param page: The page wanted, kept in the pages there are.
+    :return: The page, how many pages there are and the first / past the last
+    ID on the page.
+    """
+    size = conf["page_size"]
+    if ((not size) or (total <= size)):
+        return (0, 1, 0, total)
+    pages = -(-total // size)
+    page = min(max(page, 0), (pages - 1))
+    start = page * size
+    return (page, pages, start, min((start + size), total))
+
+def show_crumbs(conf: Dict[str, Any], res: List[Task], page: int = 0) -> None:
+    """
+    Shows a selection of crumbs. A selection larger than page_size is shown a
+    page at a time (after a count of what is in it), ?p shows the others.
+
+    :param conf: The configuration to display with.
+    :param res: The selection.
+    :param page: The page to show.
+    """
+    page, pages, start, end = page_bounds(conf, len(res), page)
+    conf["buffers"]["page"] = page
+    if (pages == 1):
+        conf["log"]["crumbs"](res)
+        return
+    conf["log"]["info"](f"{len(res)} crumbs, showing IDs {start}-{end - 1}"
+                        f" (page {page + 1}/{pages}).")
+    conf["log"]["crumbs"](res[start:end])
+    conf["log"]["info"]("?p for the next page, ?p <ID> to jump to a crumb,"
+                        " ?vv to pick by ID.")
+
+def write_buffer(conf: Dict[str, Any]) -> None:
+    """
+    Writes the active buffer to disk (<breadbox>/selection_buffer) so it can
+    be edited externally.
+
+    :param conf: The configuration where the buffer is located.
+    """
     t = TodoTxt(Path(conf['breadbox'] + '/selection_buffer'))
-    t.tasks = data
+    t.tasks = conf["buffers"]["selection_buffer"]
     t.save(safe=True)
 
-def easy_lex(text: Any) -> Syntax:
+class CachedSyntax(Syntax):
+    """
+    A syntax block that keeps the highlighted text of what it showed last (up
+    to HIGHLIGHT_CACHE_SIZE of them), by text and theme.
+    """
+
+    def __init__(self, code: str, lexer: Any, *, theme: str = "ansi_light",
+                 **kwargs) -> None:
+        """
+        :param code: The code to show.
+        :param lexer: The lexer to highlight with.
+        :param theme: The theme to highlight with.
+        """
+        super().__init__(code, lexer, theme=theme, **kwargs)
+        # The theme by name, to key the highlight cache with
+        self.theme_name = str(theme)
+
+    def highlight(self, code: str, line_range: Union[Tuple, None] = None
+                  ) -> Text:
+        """
+        Highlights code, reusing the text highlighted before if there is one.
+
+        :param code: The code to highlight.
+        :param line_range: The lines to highlight, None for all.
+        :return: The highlighted text.
+        """
+        if (line_range is not None):
+            return super().highlight(code, line_range)
+        key = (code, self.theme_name)
+        ret = HIGHLIGHT_CACHE.get(key, None)
+        if (ret is not None):
+            HIGHLIGHT_CACHE.move_to_end(key)
+        else:
+            ret = super().highlight(code)
+            HIGHLIGHT_CACHE[key] = ret
+            if (len(HIGHLIGHT_CACHE) > HIGHLIGHT_CACHE_SIZE):
+                HIGHLIGHT_CACHE.popitem(last=False)
+        # Rendering may change the text, so hand out a copy
+        return ret.copy()
+
+def easy_lex(text: Any, theme: str = "ansi_light") -> Syntax:
     """
     Wrap text in a syntax block.
 
     :param text: the text to wrap.
+    :param theme: the theme to highlight with.
     :return: the wrapped object.
     """
-    tmp = Syntax(str(text), lexer=TodotxtLexer(), word_wrap = True,
-                               theme="ansi_light")
+    tmp = CachedSyntax(str(text), lexer=LEXER, word_wrap = True,
+                       theme=theme)
     return tmp
 